@@ -0,0 +1,723 @@
+import argparse
+import asyncio
+import collections
+import gc
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+# Keep the sampled request log out of the benchmark output.
+os.environ.setdefault("KPI_LOG_SAMPLE_RATE", "0")
+
+import fin_analyst_api
+import simple_analyst_api
+from fin_analyst_api import (FIELDS, KPI_NAMES, FinancialData, analyze_data, calculate_kpi,
+                             calculate_kpi_grid, calculate_kpi_matrix, calculate_kpi_values, kpi_cache, record_values,
+                             render_flat_kpis)
+from fin_analyst_api import app as fin_app
+from financial_analyst_api import FinancialDetails, calculate_kpis, new_time_series_panel
+from financial_analyst_api import app as financial_app
+from kpi_jobs import JobManager
+from kpi_snapshots import LazySnapshotStore
+
+
+def synthetic_records(n: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    return [[rng.uniform(0, 1e6) if rng.random() > 0.05 else 0.0 for _ in FIELDS] for _ in range(n)]
+
+
+def bench_batch(n: int) -> dict:
+    # The scalar formulas against the kernel, and the whole /analyze/batch request (decode,
+    # compute, encode) for a records and a columns body of the same statements.
+    records = synthetic_records(n)
+
+    start = time.perf_counter()
+    for record in records:
+        calculate_kpi(*record)
+    scalar_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    calculate_kpi_matrix(np.array(records))
+    batch_seconds = time.perf_counter() - start
+
+    result = {
+        "records": n,
+        "scalar_records_per_second": round(n / scalar_seconds),
+        "batch_records_per_second": round(n / batch_seconds),
+        "speedup": round(scalar_seconds / batch_seconds, 1),
+    }
+    bodies = {
+        "records": json.dumps({"records": [dict(zip(FIELDS, record)) for record in records]}).encode(),
+        "columns": json.dumps({"columns": dict(zip(FIELDS, map(list, zip(*records))))}).encode(),
+    }
+    for layout, body in bodies.items():
+        seconds = min(asyncio.run(_time_requests(fin_app, "/analyze/batch", [body])) for _ in range(3)) / 1e6
+        result[f"endpoint_{layout}_records_per_second"] = round(n / seconds)
+        result[f"endpoint_{layout}_ms"] = round(seconds * 1e3, 1)
+    return result
+
+
+def bench_explain(n: int) -> dict:
+    records = synthetic_records(n)
+    result = {"records": n}
+    for explain in (True, False):
+        start = time.perf_counter()
+        payload_bytes = 0
+        for record in records:
+            body = json.dumps(jsonable_encoder({"kpis": calculate_kpi(*record, explain=explain)})).encode()
+            payload_bytes += len(body)
+        seconds = time.perf_counter() - start
+        mode = "explained" if explain else "flat"
+        result[f"{mode}_us_per_request"] = round(seconds / n * 1e6, 1)
+        result[f"{mode}_bytes_per_response"] = payload_bytes // n
+    return result
+
+
+def synthetic_panel(companies: int, years: int, seed: int = 0) -> pd.DataFrame:
+    rng = np.random.default_rng(seed)
+    index = pd.MultiIndex.from_product([[f"company-{i}" for i in range(companies)], range(2000, 2000 + years)],
+                                       names=["company", "year"])
+    fields = list(FinancialDetails.__annotations__)
+    return pd.DataFrame(rng.uniform(0, 1e6, (len(index), len(fields))), index=index, columns=fields)
+
+
+def bench_timeseries(companies: int, years: int = 30) -> dict:
+    history = synthetic_panel(companies, years + 1)
+    last_year = history.index.get_level_values("year") == history.index.get_level_values("year").max()
+    panel = new_time_series_panel()
+
+    start = time.perf_counter()
+    panel.load(history[~last_year])
+    full_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    panel.compute(history)
+    recompute_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    panel.append(history[last_year])
+    append_seconds = time.perf_counter() - start
+
+    single = history[last_year].iloc[:1].copy()
+    single.index = pd.MultiIndex.from_tuples([(single.index[0][0], 2000 + years + 1)], names=["company", "year"])
+    start = time.perf_counter()
+    panel.append(single)
+    append_one_seconds = time.perf_counter() - start
+
+    return {
+        "companies": companies,
+        "years": years,
+        "full_pass_seconds": round(full_seconds, 3),
+        "full_rows_per_second": round(companies * years / full_seconds),
+        "recompute_with_new_year_seconds": round(recompute_seconds, 3),
+        "append_new_year_all_companies_seconds": round(append_seconds, 3),
+        "append_one_company_year_ms": round(append_one_seconds * 1e3, 1),
+    }
+
+
+def synthetic_matrix(n: int, seed: int = 0) -> np.ndarray:
+    return np.random.default_rng(seed).uniform(0, 1e6, (n, len(FIELDS)))
+
+
+def _analyze_latency_us(samples: int = 200) -> float:
+    # Fresh random inputs so the /analyze response cache does not answer.
+    bodies = [json.dumps({"equity": random.random(), "intangible_assets": 3}).encode() for _ in range(samples)]
+    return round(asyncio.run(_time_requests(fin_app, "/analyze?explain=false", bodies)), 1)
+
+
+async def _analyze_during_http_job(body: bytes) -> tuple:
+    # Mean /analyze latency while POST /jobs uploads, validates and computes a portfolio,
+    # and the seconds from the upload to the finished job.
+    manager = fin_analyst_api.job_manager
+    manager.wait(manager.submit(synthetic_matrix(1)))
+
+    async def submit():
+        status, response = await _asgi_post(fin_app, "/jobs", body)
+        if status != 202:
+            raise RuntimeError(f"/jobs answered {status}: {response[:200]!r}")
+        job = manager.get(json.loads(response)["id"])
+        await asyncio.get_running_loop().run_in_executor(None, manager.wait, job)
+
+    start = time.perf_counter()
+    task = asyncio.ensure_future(submit())
+    latencies = []
+    while not task.done():
+        analyze_body = json.dumps({"equity": random.random(), "intangible_assets": 3}).encode()
+        sent = time.perf_counter()
+        await _asgi_post(fin_app, "/analyze?explain=false", analyze_body)
+        latencies.append(time.perf_counter() - sent)
+        await asyncio.sleep(0.001)
+    await task
+    return round(statistics.mean(latencies) * 1e6, 1), round(time.perf_counter() - start, 2)
+
+
+def bench_jobs(n: int) -> dict:
+    values = synthetic_matrix(n)
+    result = {"records": n, "cpus": os.cpu_count(), "idle_analyze_us": _analyze_latency_us()}
+    # The whole HTTP path: /analyze while a records upload of n statements is decoded and run.
+    body = json.dumps({"records": [dict(zip(FIELDS, row)) for row in values.tolist()]}).encode()
+    result["analyze_us_during_http_job"], result["http_job_seconds"] = asyncio.run(_analyze_during_http_job(body))
+    fin_analyst_api.job_manager.shutdown()
+    for workers in range(1, os.cpu_count() + 1):
+        manager = JobManager(calculate_kpi_matrix, workers=workers, shard_size=max(1, n // (workers * 4)))
+        manager.wait(manager.submit(synthetic_matrix(workers)))
+        start = time.perf_counter()
+        job = manager.submit(values)
+        busy_latency = _analyze_latency_us()
+        manager.wait(job)
+        seconds = time.perf_counter() - start
+        manager.shutdown()
+        result[f"workers_{workers}_records_per_second"] = round(n / seconds)
+        result[f"workers_{workers}_analyze_us_during_job"] = busy_latency
+    return result
+
+
+def _peak_bytes(function, arguments: list) -> int:
+    # Mean tracemalloc peak above the starting point over single calls, each result dropped
+    # before the next call: what one call allocates on its way, not what it leaves behind.
+    peaks = []
+    tracemalloc.start()
+    for argument in arguments:
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        function(argument)
+        peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+    tracemalloc.stop()
+    return round(statistics.mean(peaks))
+
+
+def _latency_us(function, arguments: list) -> float:
+    start = time.perf_counter()
+    for argument in arguments:
+        function(argument)
+    return round((time.perf_counter() - start) / len(arguments) * 1e6, 2)
+
+
+def bench_alloc(n: int) -> dict:
+    rng = random.Random(0)
+    data = [FinancialData(**{name: rng.uniform(1, 1e6) for name in FIELDS}) for _ in range(n)]
+    paths = {
+        "flat_dict_response": lambda record: JSONResponse({"kpis": analyze_data(record, explain=False)}).body,
+        "fixed_layout_response": lambda record: render_flat_kpis(calculate_kpi_values(record_values(record))),
+    }
+    result = {"records": n}
+    for name, function in paths.items():
+        result[f"{name}_us"] = _latency_us(function, data)
+        result[f"{name}_peak_bytes_per_call"] = _peak_bytes(function, data)
+
+    matrix = np.array([record_values(record) for record in data])
+    kpis = np.empty((n, len(KPI_NAMES)))
+    tracemalloc.start()
+    calculate_kpi_matrix(matrix, kpis)
+    result["batch_peak_bytes_per_record"] = round(tracemalloc.get_traced_memory()[1] / n)
+    tracemalloc.stop()
+    return result
+
+
+async def _asgi_post(asgi_app, path: str, body: bytes, method: str = "POST") -> tuple:
+    # One request through the ASGI app in-process: (status, response body).
+    path, _, query = path.partition("?")
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method, "scheme": "http",
+        "path": path, "raw_path": path.encode(), "query_string": query.encode(), "root_path": "",
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        "client": ("127.0.0.1", 0), "server": ("127.0.0.1", 80),
+    }
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    response = {"status": None, "body": []}
+
+    async def receive():
+        return messages.pop() if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+        elif message["type"] == "http.response.body":
+            response["body"].append(message.get("body", b""))
+
+    await asgi_app(scope, receive, send)
+    return response["status"], b"".join(response["body"])
+
+
+def bench_request(n: int) -> dict:
+    # Per-request latency of /analyze vs /analyze/fast through the full FastAPI stack, with
+    # unique bodies (cache misses) and one repeated body (cache hits).
+    rng = random.Random(0)
+    bodies = [json.dumps({name: rng.uniform(1, 1e6) for name in FIELDS}).encode() for _ in range(n)]
+
+    async def run(path: str, payloads: list) -> float:
+        start = time.perf_counter()
+        for body in payloads:
+            status, _ = await _asgi_post(fin_app, path, body)
+            assert status == 200, status
+        return round((time.perf_counter() - start) / len(payloads) * 1e6, 1)
+
+    result = {"requests": n}
+    for explain in ("true", "false"):
+        for route in ("/analyze", "/analyze/fast"):
+            name = f"{route.strip('/').replace('/', '_')}_explain_{explain}"
+            result[f"{name}_miss_us"] = asyncio.run(run(f"{route}?explain={explain}", bodies))
+            result[f"{name}_hit_us"] = asyncio.run(run(f"{route}?explain={explain}", bodies[:1] * n))
+    return result
+
+
+def bench_scenario(n: int) -> dict:
+    # A two-field sweep with about n points (cogs +1%..+50% x cash haircut 0..50%): grid
+    # evaluation against materializing every point as a row, and the whole endpoint.
+    side = max(1, int(n ** 0.5))
+    base = synthetic_matrix(1)[0]
+    cogs, cash = FIELDS.index("cogs"), FIELDS.index("cash_and_cash_equivalents")
+    inputs = {"cogs": base[cogs] * (1 + np.linspace(0.01, 0.5, side)),
+              "cash_and_cash_equivalents": base[cash] * (1 - np.linspace(0, 0.5, side))}
+    rows = np.tile(base, (side * side, 1))
+    rows[:, cogs] = np.repeat(inputs["cogs"], side)
+    rows[:, cash] = np.tile(inputs["cash_and_cash_equivalents"], side)
+
+    def best_ms(function, repeat: int = 5) -> float:
+        timings = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            function()
+            timings.append(time.perf_counter() - start)
+        return round(min(timings) * 1e3, 2)
+
+    body = json.dumps({
+        "base": dict(zip(FIELDS, base.tolist())),
+        "perturbations": [{"field": "cogs", "start": 0.01, "stop": 0.5, "count": side},
+                          {"field": "cash_and_cash_equivalents", "start": 0, "stop": -0.5, "count": side}],
+    }).encode()
+    top10_body = body[:-1] + b', "kpis": ' + json.dumps(KPI_NAMES[-10:]).encode() + b"}"
+
+    async def endpoint_ms(payload: bytes, repeat: int = 5) -> float:
+        # One event loop for all passes, after a warm-up request.
+        await _asgi_post(fin_app, "/analyze/scenarios", payload)
+        return round(await _time_requests(fin_app, "/analyze/scenarios", [payload] * repeat) / 1e3, 2)
+
+    return {
+        "points": side * side,
+        "grid_ms": best_ms(lambda: calculate_kpi_grid(base, inputs)),
+        "row_matrix_ms": best_ms(lambda: calculate_kpi_matrix(rows)),
+        "scalar_ms": best_ms(lambda: [calculate_kpi_values(row) for row in rows.tolist()], repeat=1),
+        "endpoint_ms": asyncio.run(endpoint_ms(body)),
+        "endpoint_top10_kpis_ms": asyncio.run(endpoint_ms(top10_body)),
+    }
+
+
+def bench_snapshot(n: int) -> dict:
+    # Lookups of stored KPIs for n company-years (n / 10 companies x 10 years) in a fresh
+    # snapshot store against recomputing them, directly and through the endpoints.
+    values = synthetic_matrix(n)
+    companies = [f"company-{i // 10}" for i in range(n)]
+    years = [2015 + i % 10 for i in range(n)]
+    with tempfile.TemporaryDirectory() as directory:
+        lazy_store = LazySnapshotStore("bench", lambda: KPI_NAMES, root=directory)
+        store = lazy_store()
+        start = time.perf_counter()
+        store.append(companies, years, calculate_kpi_matrix(values))
+        append_ms = (time.perf_counter() - start) * 1e3
+        rows = values.tolist()
+        sample = random.Random(0).sample(range(n), min(n, 1000))
+
+        def per_call_us(function) -> float:
+            start = time.perf_counter()
+            for i in sample:
+                function(i)
+            return round((time.perf_counter() - start) / len(sample) * 1e6, 1)
+
+        result = {
+            "rows": n,
+            "append_ms": round(append_ms, 1),
+            "get_us": per_call_us(lambda i: store.get(companies[i], years[i])),
+            "recompute_us": per_call_us(lambda i: dict(zip(KPI_NAMES, calculate_kpi_values(rows[i])))),
+            "scan_10_years_us": per_call_us(lambda i: store.scan(companies[i])),
+        }
+
+        previous, fin_analyst_api.snapshot_store = fin_analyst_api.snapshot_store, lazy_store
+        try:
+            bodies = [json.dumps(dict(zip(FIELDS, rows[i]))).encode() for i in sample]
+
+            async def endpoints() -> tuple:
+                start = time.perf_counter()
+                for i in sample:
+                    status, _ = await _asgi_post(fin_app, f"/kpis/{companies[i]}/{years[i]}", b"", method="GET")
+                    assert status == 200, status
+                lookup = (time.perf_counter() - start) / len(sample) * 1e6
+                kpi_cache.clear()
+                return lookup, await _time_requests(fin_app, "/analyze/fast", bodies)
+
+            lookup_us, analyze_us = asyncio.run(endpoints())
+        finally:
+            fin_analyst_api.snapshot_store = previous
+    result["endpoint_get_us"] = round(lookup_us, 1)
+    result["endpoint_analyze_fast_us"] = round(analyze_us, 1)
+    return result
+
+
+async def _http_post(reader, writer, path: str, body: bytes, client: str) -> tuple:
+    # One keep-alive HTTP/1.1 POST: (status, headers, body).
+    writer.write((f"POST {path} HTTP/1.1\r\nhost: localhost\r\ncontent-type: application/json\r\n"
+                  f"content-length: {len(body)}\r\nx-forwarded-for: {client}\r\n\r\n").encode() + body)
+    await writer.drain()
+    lines = (await reader.readuntil(b"\r\n\r\n")).decode("latin-1").split("\r\n")
+    headers = {name.lower(): value.strip() for name, _, value in (line.partition(":") for line in lines[1:] if line)}
+    return int(lines[0].split()[1]), headers, await reader.readexactly(int(headers.get("content-length", 0)))
+
+
+def _start_server(port: int, env: dict) -> subprocess.Popen:
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "fin_analyst_api:app", "--port", str(port), "--log-level", "warning"],
+        env={**os.environ, "KPI_LOG_SAMPLE_RATE": "0", **env})
+    deadline = time.time() + 30
+    while True:
+        try:
+            with socket.create_connection(("127.0.0.1", port), timeout=1):
+                return server
+        except OSError:
+            if time.time() > deadline or server.poll() is not None:
+                server.kill()
+                raise RuntimeError("uvicorn did not start")
+            time.sleep(0.1)
+
+
+def bench_overload(n: int, rate: float = 300, clients: int = 5) -> dict:
+    # Tail latency against a local uvicorn server driven past its capacity: n requests
+    # arrive at a fixed `rate` per second whatever the server does (open loop), each on its
+    # own connection, from `clients` addresses in turn, without retries. One in four is a
+    # /analyze/scenarios sweep (one of 8, so identical sweeps overlap), the rest unique
+    # /analyze?explain=false statements. Run with admission limits and coalescing
+    # effectively off, with the default limits but no coalescing, and with the defaults.
+    rng = random.Random(0)
+    sweeps = [json.dumps({
+        "base": synthetic_fin_payload(rng),
+        "perturbations": [{"field": "cogs", "start": 0.01, "stop": 0.5, "count": 200},
+                          {"field": "cash_and_cash_equivalents", "start": 0, "stop": -0.5, "count": 200 + i}],
+        # One KPI keeps the response small enough that compute, not sending it, is the load.
+        "kpis": ["Return on Sales"],
+    }).encode() for i in range(8)]
+    work = [("scenario", "/analyze/scenarios", rng.choice(sweeps)) if i % 4 == 0 else
+            ("analyze", "/analyze?explain=false", json.dumps(synthetic_fin_payload(rng)).encode()) for i in range(n)]
+    configs = {
+        "unbounded": {"KPI_MAX_QUEUE": "1000000", "KPI_CLIENT_CONCURRENCY": "1000000", "KPI_COALESCE": "0"},
+        "limits_only": {"KPI_COALESCE": "0"},
+        "scheduled": {},
+    }
+
+    async def load(port: int) -> tuple:
+        samples = []
+
+        async def send(i: int, kind: str, path: str, body: bytes):
+            await asyncio.sleep(start + i / rate - time.perf_counter())
+            sent = time.perf_counter()
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+            status, headers, _ = await _http_post(reader, writer, path, body, f"10.0.0.{i % clients + 1}")
+            samples.append((kind, status, time.perf_counter() - sent, headers.get("retry-after")))
+            writer.close()
+
+        start = time.perf_counter()
+        await asyncio.gather(*[send(i, *request) for i, request in enumerate(work)])
+        return samples, time.perf_counter() - start
+
+    def percentile_ms(latencies: list, q: float) -> Optional[float]:
+        if not latencies:
+            return None
+        return round(sorted(latencies)[min(len(latencies) - 1, int(q * len(latencies)))] * 1e3, 1)
+
+    result = {"requests": n, "rate": rate, "clients": clients}
+    for name, env in configs.items():
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            port = probe.getsockname()[1]
+        server = _start_server(port, env)
+        try:
+            samples, seconds = asyncio.run(load(port))
+        finally:
+            server.terminate()
+            server.wait()
+        summary = {"seconds": round(seconds, 2), "served_per_second": round(sum(status == 200 for _, status, _, _ in samples) / seconds)}
+        for kind in ("analyze", "scenario"):
+            ok = [latency for k, status, latency, _ in samples if k == kind and status == 200]
+            rejected = [latency for k, status, latency, _ in samples if k == kind and status in (429, 503)]
+            summary[kind] = {
+                "ok": len(ok), "p50_ms": percentile_ms(ok, 0.5), "p99_ms": percentile_ms(ok, 0.99),
+                "max_ms": percentile_ms(ok, 1.0), "rejected": len(rejected), "rejected_p99_ms": percentile_ms(rejected, 0.99),
+            }
+        summary["statuses"] = dict(sorted(collections.Counter(status for _, status, _, _ in samples).items()))
+        summary["retry_after"] = sorted({int(value) for _, _, _, value in samples if value})
+        result[name] = summary
+    return result
+
+
+# Regression suite: a fixed set of cases over all three apps, each reduced to microseconds
+# per call or request (best of `repeat` passes), appended to a JSON history and compared
+# against the median of recent runs.
+SIMPLE_FIELDS = tuple(simple_analyst_api.FinancialData.__fields__)
+
+
+def synthetic_fin_payload(rng: random.Random) -> dict:
+    return {name: round(rng.uniform(0, 1e6), 2) for name in FIELDS}
+
+
+def synthetic_figures_payload(rng: random.Random, years: int) -> dict:
+    # financial_analyst_api FinancialFigures body: one FinancialDetails per year.
+    return {"data": {str(2000 + year): {name: round(rng.uniform(0, 1e6), 2) for name in FinancialDetails.__annotations__}
+                     for year in range(years)}}
+
+
+def synthetic_simple_payload(rng: random.Random) -> dict:
+    # simple_analyst_api requires every field and all of them > 0.
+    return {name: round(rng.uniform(1, 1e6), 2) for name in SIMPLE_FIELDS}
+
+
+def load_workload(path: str) -> list:
+    # A replayable workload is a JSONL file with one request body per line.
+    with open(path) as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def suite_cases(requests: int, sizes: list, workload: Optional[str]) -> dict:
+    # name -> ("call", function, arguments), ("request", (app, path), bodies) or
+    # ("uncached", (app, path), bodies): requests with the response cache cleared before each.
+    rng = random.Random(0)
+    calls = requests * 10
+    encode = lambda payloads: [json.dumps(payload).encode() for payload in payloads]
+    cases = {
+        "fin.calculate_kpi": ("call", lambda record: calculate_kpi(*record), synthetic_records(calls)),
+        "simple.calculate_return_on_equity": (
+            "call",
+            lambda data: simple_analyst_api.calculate_return_on_equity(
+                simple_analyst_api.calculate_earnings(data["sales_revenues"], data["cogs"]), data["equity"]),
+            [synthetic_simple_payload(rng) for _ in range(calls)],
+        ),
+        "fin POST /analyze": ("request", (fin_app, "/analyze"), encode(synthetic_fin_payload(rng) for _ in range(requests))),
+        "fin POST /analyze?explain=false": (
+            "request", (fin_app, "/analyze?explain=false"), encode(synthetic_fin_payload(rng) for _ in range(requests))),
+        "fin POST /analyze/fast": (
+            "request", (fin_app, "/analyze/fast"), encode(synthetic_fin_payload(rng) for _ in range(requests))),
+        "simple POST /analyze": (
+            "request", (simple_analyst_api.app, "/analyze"), encode(synthetic_simple_payload(rng) for _ in range(requests))),
+    }
+    for size in sizes:
+        figures = [synthetic_figures_payload(rng, size) for _ in range(max(1, calls // size))]
+        cases[f"financial.calculate_kpis[years={size}]"] = ("call", lambda payload: calculate_kpis(payload["data"]), figures)
+        cases[f"fin.calculate_kpi_matrix[records={size}]"] = (
+            "call", calculate_kpi_matrix, [synthetic_matrix(size, seed) for seed in range(max(1, calls // size))])
+        count = max(1, requests // size)
+        cases[f"financial POST /calculateKPIs[years={size}]"] = (
+            "request", (financial_app, "/calculateKPIs"), encode(synthetic_figures_payload(rng, size) for _ in range(count)))
+        cases[f"fin POST /analyze/batch[records={size}]"] = (
+            "request", (fin_app, "/analyze/batch"),
+            encode({"records": [synthetic_fin_payload(rng) for _ in range(size)]} for _ in range(count)))
+    sweep = {"base": synthetic_fin_payload(rng),
+             "perturbations": [{"field": "cogs", "start": 0.01, "stop": 0.5, "count": 100},
+                               {"field": "cash_and_cash_equivalents", "start": 0, "stop": -0.5, "count": 100}]}
+    cases["fin POST /analyze/scenarios[points=10000]"] = (
+        "request", (fin_app, "/analyze/scenarios"), encode([sweep] * max(1, requests // 100)))
+    if workload:
+        payloads = load_workload(workload)
+        bodies = encode(payloads[i % len(payloads)] for i in range(requests))
+        # Replayed bodies can repeat a statement (every line of the default requests.jsonl
+        # is the all-zero one), so the cache is cleared per request to measure the compute.
+        cases[f"replay {os.path.basename(workload)} POST /analyze[uncached]"] = ("uncached", (fin_app, "/analyze"), bodies)
+    return cases
+
+
+def _time_calls(function, arguments: list) -> float:
+    start = time.perf_counter()
+    for argument in arguments:
+        function(argument)
+    return (time.perf_counter() - start) / len(arguments) * 1e6
+
+
+async def _time_requests(asgi_app, path: str, bodies: list, uncached: bool = False) -> float:
+    start = time.perf_counter()
+    for body in bodies:
+        if uncached:
+            kpi_cache.clear()
+        status, response = await _asgi_post(asgi_app, path, body)
+        if status != 200:
+            raise RuntimeError(f"{path} answered {status}: {response[:200]!r}")
+    return (time.perf_counter() - start) / len(bodies) * 1e6
+
+
+async def _request_peak_bytes(asgi_app, path: str, bodies: list, uncached: bool = False) -> int:
+    # Mean tracemalloc peak above the starting point over single requests.
+    peaks = []
+    tracemalloc.start()
+    for body in bodies:
+        if uncached:
+            kpi_cache.clear()
+        tracemalloc.reset_peak()
+        baseline = tracemalloc.get_traced_memory()[0]
+        await _asgi_post(asgi_app, path, body)
+        peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+    tracemalloc.stop()
+    return round(statistics.mean(peaks))
+
+
+def run_case(kind: str, target, arguments: list, repeat: int) -> dict:
+    # Every pass is preceded by a calibration run and also recorded relative to it, so a
+    # machine that gets slower or busier partway through the suite does not read as a
+    # regression of whichever cases ran meanwhile.
+    timings = []
+    relative = []
+    # Collection is off while timing, as in timeit.
+    for _ in range(repeat):
+        kpi_cache.clear()
+        gc.collect()
+        calibration_us = calibrate(3)
+        gc.disable()
+        try:
+            if kind == "call":
+                timings.append(_time_calls(target, arguments))
+            else:
+                timings.append(asyncio.run(_time_requests(*target, arguments, uncached=kind == "uncached")))
+        finally:
+            gc.enable()
+        relative.append(timings[-1] / calibration_us)
+    us = min(timings)
+    result = {"us": round(us, 2), "per_second": round(1e6 / us), "relative": round(min(relative), 6)}
+    if kind != "call":
+        kpi_cache.clear()
+        result["peak_bytes"] = asyncio.run(_request_peak_bytes(*target, arguments[:200], uncached=kind == "uncached"))
+    return result
+
+
+def calibrate(repeat: int = 10) -> float:
+    # Microseconds for a fixed pure-Python workload. Timings are compared relative to it,
+    # so a slower or busier machine does not read as a regression.
+    def workload():
+        total = 0.0
+        for i in range(1, 20001):
+            total += round(i / 7, 4) if i % 3 else 0
+        return total
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        workload()
+        timings.append((time.perf_counter() - start) * 1e6)
+    return min(timings)
+
+
+MIN_BASELINE_RUNS = 3
+
+
+def find_regressions(results: dict, history: list, threshold: float, baseline_runs: int) -> list:
+    # A case regresses when its time relative to the calibration workload exceeds the
+    # median of its last `baseline_runs` runs that did not flag it by more than `threshold`
+    # (0.2 = 20%) plus three times their spread (1.4826 median absolute deviations, a
+    # standard deviation robust to the odd slow run). The spread is noise the suite has
+    # shown on unchanged code; only a slowdown beyond it counts, so a case is not judged
+    # before it has MIN_BASELINE_RUNS runs to estimate it from.
+    regressions = []
+    for name, result in results.items():
+        previous = [run["results"][name]["relative"] for run in history
+                    if "relative" in run["results"].get(name, {})
+                    and name not in {regression["case"] for regression in run.get("regressions", [])}][-baseline_runs:]
+        if len(previous) < MIN_BASELINE_RUNS:
+            continue
+        baseline = statistics.median(previous)
+        spread = 1.4826 * statistics.median(abs(relative - baseline) for relative in previous)
+        limit = baseline * (1 + threshold) + 3 * spread
+        if result["relative"] > limit:
+            # Reported in microseconds at the calibration speed this case ran at.
+            scale = result["us"] / result["relative"]
+            regressions.append({"case": name, "us": result["us"], "baseline_us": round(baseline * scale, 2),
+                                "limit_us": round(limit * scale, 2), "change": round(result["relative"] / baseline - 1, 3)})
+    return regressions
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(args: argparse.Namespace) -> int:
+    cases = suite_cases(args.requests, args.sizes, args.workload if os.path.exists(args.workload or "") else None)
+    results = {}
+    for name, (kind, target, arguments) in cases.items():
+        if args.only and not any(part in name for part in args.only):
+            continue
+        results[name] = run_case(kind, target, arguments, args.repeat)
+        print(f"{name:<50} {results[name]['us']:>12.2f} us {results[name]['per_second']:>10}/s"
+              + (f" {results[name]['peak_bytes'] / 1024:>9.1f} KiB peak" if "peak_bytes" in results[name] else ""))
+
+    history = []
+    if os.path.exists(args.history):
+        with open(args.history) as file:
+            history = json.load(file)
+    calibration_us = calibrate()
+    print(f"{'calibration':<50} {calibration_us:>12.2f} us")
+    regressions = find_regressions(results, history, args.threshold, args.baseline_runs)
+    if regressions:
+        # Timing noise is one-sided, so a flagged case is re-run with twice the passes and
+        # keeps its best pass; it fails only if that still exceeds the limit.
+        for regression in regressions:
+            name = regression["case"]
+            kind, target, arguments = cases[name]
+            rerun = run_case(kind, target, arguments, args.repeat * 2)
+            print(f"{name:<50} {rerun['us']:>12.2f} us (re-run, limit {regression['limit_us']:.2f} us)")
+            if rerun["relative"] < results[name]["relative"]:
+                results[name].update(us=rerun["us"], per_second=rerun["per_second"], relative=rerun["relative"])
+        regressions = find_regressions(results, history, args.threshold, args.baseline_runs)
+    for regression in regressions:
+        print(f"REGRESSION {regression['case']}: {regression['us']} us vs baseline {regression['baseline_us']} us, "
+              f"limit {regression['limit_us']} us ({regression['change']:+.0%})")
+    if not args.no_save:
+        history.append({"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "revision": _git_revision(),
+                        "python": sys.version.split()[0], "cpus": os.cpu_count(),
+                        "calibration_us": round(calibration_us, 2), "results": results,
+                        "regressions": regressions})
+        with open(args.history + ".tmp", "w") as file:
+            json.dump(history, file, indent=1)
+        os.replace(args.history + ".tmp", args.history)
+    return 1 if regressions else 0
+
+
+BENCHMARKS = {
+    "batch": bench_batch,
+    "explain": bench_explain,
+    "timeseries": bench_timeseries,
+    "jobs": bench_jobs,
+    "alloc": bench_alloc,
+    "request": bench_request,
+    "scenario": bench_scenario,
+    "snapshot": bench_snapshot,
+    "overload": bench_overload,
+}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks for the financial analyst APIs.")
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS) + ["suite"])
+    parser.add_argument("--size", type=int, default=20000)
+    suite = parser.add_argument_group("suite", "Regression suite over all three apps.")
+    suite.add_argument("--requests", type=int, default=500, help="Requests per endpoint case (calls are 10x this).")
+    suite.add_argument("--sizes", type=lambda value: [int(size) for size in value.split(",")], default=[1, 10, 100],
+                       help="Statements per call for the multi-statement cases.")
+    suite.add_argument("--repeat", type=int, default=5, help="Passes per case; the fastest one counts.")
+    suite.add_argument("--workload", default="requests.jsonl", help="JSONL request bodies replayed against /analyze.")
+    suite.add_argument("--only", nargs="*", help="Run only the cases whose name contains one of these strings.")
+    suite.add_argument("--history", default="benchmark_history.json")
+    suite.add_argument("--threshold", type=float, default=0.2, help="Allowed slowdown against the baseline.")
+    suite.add_argument("--baseline-runs", type=int, default=10, help="Passing runs the baseline and its spread come from.")
+    suite.add_argument("--no-save", action="store_true", help="Compare without appending to the history.")
+    args = parser.parse_args()
+    if args.benchmark == "suite":
+        sys.exit(run_suite(args))
+    print(BENCHMARKS[args.benchmark](args.size))
@@ -1,6 +1,24 @@
-from fastapi import FastAPI, HTTPException
-from pydantic import BaseModel, Field
-from typing import Optional, List
+import asyncio
+import codecs
+import csv
+import json
+import math
+import operator
+import os
+import numpy as np
+import orjson
+from fastapi import FastAPI, HTTPException, Path, Query, Request
+from fastapi.exceptions import RequestValidationError
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field, ValidationError
+from typing import Any, Callable, Literal, Optional, List, Dict, Tuple, Mapping, AsyncIterator, Sequence
+from kpi_cache import KPICache, cache_key
+from kpi_jobs import JobManager
+from kpi_kernel import KPI_NAMES, BatchError, calculate_kpi_matrix, decode_batch, kpi_arrays
+from kpi_metrics import instrument_from_env, mark, prometheus_metric
+from kpi_peers import PeerStore
+from kpi_scheduler import Scheduler
+from kpi_snapshots import MAX_YEAR, MIN_YEAR, LazySnapshotStore
 
 app = FastAPI(
     title="Financial Analysis",
@@ -13,6 +31,22 @@ app = FastAPI(
         }
     ]
 )
+# Response cache for /analyze, keyed on the exact inputs. KPI_CACHE_SIZE=0 disables the
+# in-process LRU, KPI_CACHE_TTL=0 keeps entries until evicted, KPI_CACHE_DB names an
+# optional sqlite file shared by all workers, holding at most KPI_CACHE_DB_SIZE rows
+# (0: unbounded).
+kpi_cache = KPICache(
+    maxsize=int(os.environ.get("KPI_CACHE_SIZE", 4096)),
+    ttl=float(os.environ.get("KPI_CACHE_TTL", 0)),
+    path=os.environ.get("KPI_CACHE_DB") or None,
+    shared_maxsize=int(os.environ.get("KPI_CACHE_DB_SIZE", 100_000)),
+)
+
+# Compute-bound handlers run through this scheduler (kpi_scheduler): a bounded worker pool
+# answering 503 when its queue is full and 429 past the per-client limit, identical
+# requests in flight computed once; configured by the KPI_* variables of Scheduler.from_env.
+scheduler = Scheduler.from_env()
+
 class FinancialData(BaseModel):
     intangible_assets: float = Field(0, description="Total intangible assets.")
     property_plant_and_equipment: float = Field(0, description="Total property, plant, and equipment.")
@@ -42,108 +76,202 @@ class FinancialData(BaseModel):
     financial_income: float = Field(0, description="Total interest income.")
     op_cash_flow: float = Field(0, description="Total operating cash flow.")
 
+class FinancialDataBatch(BaseModel):
+    records: List[FinancialData] = Field([], description="Statements to analyze, one FinancialData object each.")
+    columns: Dict[str, List[float]] = Field({}, description="Columnar statements keyed by FinancialData field name. Missing fields default to 0.")
 
+class CompanyFinancialData(FinancialData):
+    company: str = Field(..., description="Company the statement belongs to.")
+    year: int = Field(..., ge=MIN_YEAR, le=MAX_YEAR, description="Fiscal year of the statement.")
+
+class CompanyFinancialDataBatch(BaseModel):
+    records: List[CompanyFinancialData] = Field(..., min_items=1, description="Statements to compute and store, one per company and year.")
+
+class Perturbation(BaseModel):
+    field: str = Field(..., description="FinancialData field to vary.")
+    mode: Literal["relative", "absolute", "set"] = Field("relative", description="relative: base * (1 + step), absolute: base + step, set: step replaces the base value.")
+    steps: List[float] = Field([], description="Explicit steps. Alternatively give start, stop and count.")
+    start: Optional[float] = Field(None, description="First step of an evenly spaced range.")
+    stop: Optional[float] = Field(None, description="Last step of an evenly spaced range.")
+    count: Optional[int] = Field(None, gt=0, description="Number of steps in the range.")
+
+class ScenarioRequest(BaseModel):
+    base: FinancialData = Field(FinancialData(), description="Statement the perturbations are applied to.")
+    perturbations: List[Perturbation] = Field(..., min_items=1, description="One grid axis per perturbed field.")
+    grid: Literal["product", "zip"] = Field("product", description="product: every combination of steps, zip: the i-th step of every perturbation together.")
+    kpis: List[str] = Field([], description="KPIs to return, default all.")
+
+
+
+# Fixed layouts: inputs in FIELDS order (a tuple per statement, an (n, len(FIELDS)) matrix
+# per batch) and KPIs in KPI_NAMES order, shared by the scalar, batch, job and cache paths.
+FIELDS = tuple(FinancialData.__fields__)
+FIELD_INDEX = {name: i for i, name in enumerate(FIELDS)}
+# Field defaults as FinancialData leaves them (unvalidated int 0).
+FIELD_DEFAULTS = tuple(field.default for field in FinancialData.__fields__.values())
+record_values = operator.attrgetter(*FIELDS)
+
+KPI_INDEX = {name: i for i, name in enumerate(KPI_NAMES)}
+
+# {"kpis": {...}} response body with a %s slot per KPI, so a flat response is rendered
+# straight from a KPI_NAMES-ordered list.
+_FLAT_RESPONSE = '{"kpis":{' + ",".join(f"{json.dumps(name, ensure_ascii=False)}:%s" for name in KPI_NAMES) + "}}"
+
+def render_flat_kpis(values: Sequence[float]) -> bytes:
+    # Same bytes as JSONResponse({"kpis": dict(zip(KPI_NAMES, values))}).body.
+    if not all(map(math.isfinite, values)):
+        raise ValueError("Out of range float values are not JSON compliant")
+    return (_FLAT_RESPONSE % tuple(map(repr, values))).encode()
+
+def calculate_kpi_values(values: Sequence[float]) -> list:
+    # Scalar KPI computation on a FIELDS-ordered record; returns the KPIs in KPI_NAMES order.
+    (intangible_assets, property_plant_and_equipment, other_non_current_assets, inventories, trade_receivables,
+     cash_and_cash_equivalents, other_current_assets, other_assets, active_accruals_deferrals, equity,
+     short_term_liabilities, long_term_liabilities, provisions, passive_accruals_deferrals, sales_revenue,
+     changes_in_inventories, cogs, other_operational_expense, depreciation, personnel_expenses, selling_expenses,
+     financial_expenses, other_expenses, other_operational_income, other_income, financial_income, op_cash_flow) = values
 
-def calculate_kpi(intangible_assets: float, property_plant_and_equipment: float, other_non_current_assets: float,
-                         inventories: float, trade_receivables: float, cash_and_cash_equivalents: float,
-                         other_current_assets: float, other_assets: float, active_accruals_deferrals: float,
-                         equity: float, short_term_liabilities: float, long_term_liabilities: float,
-                         provisions: float, passive_accruals_deferrals: float, sales_revenue: float, changes_in_inventory: float, cogs: float,
-                         other_operational_expense: float, depreciation: float, personnel_expenses: float, selling_expenses: float, financial_expenses: float,
-                         other_expenses: float, other_operational_income: float, other_income: float,
-                         financial_income: float, op_cash_flow: float) -> dict:
-    
     non_current_assets = intangible_assets + property_plant_and_equipment + other_non_current_assets
     current_assets = inventories + trade_receivables + cash_and_cash_equivalents + other_current_assets
     total_assets = non_current_assets + current_assets + other_assets + active_accruals_deferrals
     total_liabilities = short_term_liabilities+long_term_liabilities
     other_operational_expenses = other_operational_expense + abs(selling_expenses) + abs(personnel_expenses)
-    if changes_in_inventory != 0:
-        ebitda = sales_revenue + changes_in_inventory - abs(cogs) - abs(other_operational_expenses) + other_operational_income 
+    if changes_in_inventories != 0:
+        ebitda = sales_revenue + changes_in_inventories - abs(cogs) - abs(other_operational_expenses) + other_operational_income
     else:
-        ebitda = sales_revenue - abs(cogs) - abs(other_operational_expenses)  + other_operational_income 
+        ebitda = sales_revenue - abs(cogs) - abs(other_operational_expenses)  + other_operational_income
     ebit = ebitda - abs(depreciation)
     net_income = ebit - abs(financial_expenses) + financial_income - abs(other_expenses) + other_income
-    equity_ratio = round(equity / total_assets, 4) if total_assets else 0 
-    debt_ratio = round(total_liabilities / total_assets,4) if total_assets else 0
-    equity_to_fixed_assets_ratio_I = round(equity / non_current_assets,4) if non_current_assets else 0
-    equity_to_fixed_assets_ratio_II = round(equity / (non_current_assets + long_term_liabilities),4) if (non_current_assets + long_term_liabilities) else 0
     effective_debt = (short_term_liabilities + long_term_liabilities) - current_assets
-    static_gearing = round(total_liabilities / equity,4) if equity else 0
-    dynamic_gearing_in_years = round((short_term_liabilities + long_term_liabilities - current_assets) / op_cash_flow,1) if op_cash_flow else 0
-    intensity_of_inventories = round(inventories / total_assets,4) if total_assets else 0
-    working_capital = current_assets - short_term_liabilities
-    property_constitution = round(non_current_assets / total_assets,4) if total_assets else 0
-    current_ratio = round(current_assets / short_term_liabilities,4) if short_term_liabilities else 0
-    quick_ratio = round((current_assets - inventories) / short_term_liabilities,4) if short_term_liabilities else 0
-    cash_ratio = round(cash_and_cash_equivalents / short_term_liabilities,4) if short_term_liabilities else 0
-    return_on_sales = round(net_income / sales_revenue,4) if sales_revenue else 0
-    return_on_assets = round(net_income / total_assets,4) if total_assets else 0
-    return_on_equity = round(net_income / equity,4) if equity else 0
-    frequency_of_capital_turnover = round(sales_revenue / total_assets,1) if total_assets else 0
-    return_on_investment = round(net_income / (equity + total_liabilities),4) if (equity + total_liabilities) else 0
-
-    
-    ebitda_string = f"EBITDA (Earnings Before Interest, Taxes, Depreciation, and Amortization) of {ebitda:,.2f} indicates the company's operational profitability before non-cash charges and capital structure effects."
-    ebit_string = f"EBIT (Earnings Before Interest and Taxes) of {ebit:,.2f} represents the company's operating income after subtracting all operational expenses except interest and taxes."
-    net_income_string = f"Net Income of {net_income:,.2f} is the company's total earnings after deducting all expenses, including interest and taxes, indicating the company's profitability."
-    equity_ratio_string = f"The Equity Ratio of {equity_ratio*100:.2f}% indicates that equity finances {equity_ratio*100:.2f}% of the company's assets, showing the proportion of ownership funding."
-    debt_ratio_string = f"The Debt Ratio of {debt_ratio*100:.2f}% shows that {debt_ratio*100:.2f}% of the company's assets are financed through debt, highlighting the leverage level."
-    equity_to_fixed_assets_ratio_I_string = f"The Equity to Fixed Assets Ratio I of {equity_to_fixed_assets_ratio_I*100:.2f}% indicates the proportion of equity financing used for non-current assets."
-    equity_to_fixed_assets_ratio_II_string = f"The Equity to Fixed Assets Ratio II of {equity_to_fixed_assets_ratio_II*100:.2f}% shows the proportion of equity and long-term liabilities funding non-current assets."
-    effective_debt_string = f"Effective Debt of {effective_debt:,.2f} represents the net amount of short and long-term liabilities after considering current assets, highlighting the company's net leverage."
-    static_gearing_string = f"Static Gearing of {static_gearing:.2f} indicates the ratio of total liabilities to equity, showing the degree of financial leverage and risk."
-    dynamic_gearing_in_years_string = f"Dynamic Gearing in Years of {dynamic_gearing_in_years} years shows how long it would take to pay off the company's net debt using its operating cash flow."
-    intensity_of_inventories_string = f"Inventory Intensity of {intensity_of_inventories*100:.2f}% indicates that {intensity_of_inventories*100:.2f}% of the company's assets are tied up in inventories."
-    working_capital_string = f"Working Capital of {working_capital:,.2f} represents the excess of current assets over short-term liabilities, indicating the company's short-term financial health."
-    property_constitution_string = f"Property Constitution of {property_constitution*100:.2f}% shows that {property_constitution*100:.2f}% of the company's assets are non-current, indicating investment in long-term assets."
-    current_ratio_string = f"The Current Ratio of {current_ratio*100:.2f}% indicates that for every dollar of short-term liabilities, the company has {current_ratio:.2f} dollars in current assets, measuring liquidity."
-    quick_ratio_string = f"The Quick Ratio shows that the company can cover {quick_ratio*100:.2f}% of its short-term liabilities with its most liquid assets, excluding inventories."
-    cash_ratio_string = f"The Cash Ratio shows the company's ability to cover {cash_ratio*100:.2f}% of its short-term liabilities with cash and cash equivalents, indicating immediate liquidity."
-    return_on_sales_string = f"The Return on Sales of {return_on_sales*100:.2f}% indicates that the company earns {return_on_sales*100:.2f}% net income for every dollar of sales, measuring profitability."
-    return_on_assets_string = f"The Return on Assets of {return_on_assets*100:.2f}% shows that the company generates {return_on_assets*100:.2f}% net income for every dollar of assets, assessing asset efficiency."
-    return_on_equity_string = f"The Return on Equity of {return_on_equity*100:.2f}% indicates that the company generates {return_on_equity*100:.2f}% net income for every dollar of equity, measuring profitability to shareholders."
-    frequency_of_capital_turnover_string = f"The Frequency of Capital Turnover of {frequency_of_capital_turnover:.2f} times indicates how often the company's assets are converted into sales, assessing asset utilization."
-    return_on_investment_string = f"The Return on Investment of {return_on_investment*100:.2f}% shows the company's efficiency in using the combined equity and liabilities to generate profits."
-
-
-
-    # Return a dictionary instead of a list
-    return {
-    "non-current assets": non_current_assets,
-    "current assets": current_assets,
-    "total assets": total_assets,
-    "equity": equity,
-    "long-term liabilities": long_term_liabilities,
-    "short-term liabilities": short_term_liabilities,
-    "total liabilities": total_liabilities,
-    "Sales revenue": sales_revenue,
-    "changes in inventory:":changes_in_inventory,
-    "cost of goods sold (COGS)": cogs,
-    "other operational expenses": other_operational_expenses,
-    "EBITDA": {"value": ebitda, "explanation": ebitda_string},
-    "depreciation and amortization": depreciation,
-    "EBIT": {"value": ebit, "explanation": ebit_string},
-    "Net Income": {"value": net_income, "explanation": net_income_string},
-    "Equity Ratio": {"value": equity_ratio, "explanation": equity_ratio_string},
-    "Debt Ratio": {"value": debt_ratio, "explanation": debt_ratio_string},
-    "Equity to Fixed Assets Ratio I": {"value": equity_to_fixed_assets_ratio_I, "explanation": equity_to_fixed_assets_ratio_I_string},
-    "Equity to Fixed Assets Ratio II": {"value": equity_to_fixed_assets_ratio_II, "explanation": equity_to_fixed_assets_ratio_II_string},
-    "Effective Debt": {"value": effective_debt, "explanation": effective_debt_string},
-    "Static Gearing": {"value": static_gearing, "explanation": static_gearing_string},
-    "Dynamic Gearing in Years": {"value": dynamic_gearing_in_years, "explanation": dynamic_gearing_in_years_string},
-    "Intensity of Inventories": {"value": intensity_of_inventories, "explanation": intensity_of_inventories_string},
-    "Working Capital": {"value": working_capital, "explanation": working_capital_string},
-    "Property Constitution": {"value": property_constitution, "explanation": property_constitution_string},
-    "Current Ratio": {"value": current_ratio, "explanation": current_ratio_string},
-    "Quick Ratio": {"value": quick_ratio, "explanation": quick_ratio_string},
-    "Cash Ratio": {"value": cash_ratio, "explanation": cash_ratio_string},
-    "Return on Sales": {"value": return_on_sales, "explanation": return_on_sales_string},
-    "Return on Assets": {"value": return_on_assets, "explanation": return_on_assets_string},
-    "Return on Equity": {"value": return_on_equity, "explanation": return_on_equity_string},
-    "Frequency of Capital Turnover": {"value": frequency_of_capital_turnover, "explanation": frequency_of_capital_turnover_string},
-    "Return on Investment": {"value": return_on_investment, "explanation": return_on_investment_string}
+
+    return [
+        non_current_assets,
+        current_assets,
+        total_assets,
+        equity,
+        long_term_liabilities,
+        short_term_liabilities,
+        total_liabilities,
+        sales_revenue,
+        changes_in_inventories,
+        cogs,
+        other_operational_expenses,
+        ebitda,
+        depreciation,
+        ebit,
+        net_income,
+        round(equity / total_assets, 4) if total_assets else 0,
+        round(total_liabilities / total_assets,4) if total_assets else 0,
+        round(equity / non_current_assets,4) if non_current_assets else 0,
+        round(equity / (non_current_assets + long_term_liabilities),4) if (non_current_assets + long_term_liabilities) else 0,
+        effective_debt,
+        round(total_liabilities / equity,4) if equity else 0,
+        round((short_term_liabilities + long_term_liabilities - current_assets) / op_cash_flow,1) if op_cash_flow else 0,
+        round(inventories / total_assets,4) if total_assets else 0,
+        current_assets - short_term_liabilities,
+        round(non_current_assets / total_assets,4) if total_assets else 0,
+        round(current_assets / short_term_liabilities,4) if short_term_liabilities else 0,
+        round((current_assets - inventories) / short_term_liabilities,4) if short_term_liabilities else 0,
+        round(cash_and_cash_equivalents / short_term_liabilities,4) if short_term_liabilities else 0,
+        round(net_income / sales_revenue,4) if sales_revenue else 0,
+        round(net_income / total_assets,4) if total_assets else 0,
+        round(net_income / equity,4) if equity else 0,
+        round(sales_revenue / total_assets,1) if total_assets else 0,
+        round(net_income / (equity + total_liabilities),4) if (equity + total_liabilities) else 0,
+    ]
+
+def calculate_kpi(intangible_assets: float, property_plant_and_equipment: float, other_non_current_assets: float,
+                         inventories: float, trade_receivables: float, cash_and_cash_equivalents: float,
+                         other_current_assets: float, other_assets: float, active_accruals_deferrals: float,
+                         equity: float, short_term_liabilities: float, long_term_liabilities: float,
+                         provisions: float, passive_accruals_deferrals: float, sales_revenue: float, changes_in_inventory: float, cogs: float,
+                         other_operational_expense: float, depreciation: float, personnel_expenses: float, selling_expenses: float, financial_expenses: float,
+                         other_expenses: float, other_operational_income: float, other_income: float,
+                         financial_income: float, op_cash_flow: float, explain: bool = True) -> dict:
+    values = (intangible_assets, property_plant_and_equipment, other_non_current_assets, inventories, trade_receivables,
+              cash_and_cash_equivalents, other_current_assets, other_assets, active_accruals_deferrals, equity,
+              short_term_liabilities, long_term_liabilities, provisions, passive_accruals_deferrals, sales_revenue,
+              changes_in_inventory, cogs, other_operational_expense, depreciation, personnel_expenses, selling_expenses,
+              financial_expenses, other_expenses, other_operational_income, other_income, financial_income, op_cash_flow)
+    kpis = dict(zip(KPI_NAMES, calculate_kpi_values(values)))
+    if explain:
+        explain_kpis(kpis)
+    return kpis
+
+# Explanation templates, formatted with the KPI value and the value as a percentage.
+KPI_EXPLANATIONS = {
+    "EBITDA": "EBITDA (Earnings Before Interest, Taxes, Depreciation, and Amortization) of {value:,.2f} indicates the company's operational profitability before non-cash charges and capital structure effects.",
+    "EBIT": "EBIT (Earnings Before Interest and Taxes) of {value:,.2f} represents the company's operating income after subtracting all operational expenses except interest and taxes.",
+    "Net Income": "Net Income of {value:,.2f} is the company's total earnings after deducting all expenses, including interest and taxes, indicating the company's profitability.",
+    "Equity Ratio": "The Equity Ratio of {pct:.2f}% indicates that equity finances {pct:.2f}% of the company's assets, showing the proportion of ownership funding.",
+    "Debt Ratio": "The Debt Ratio of {pct:.2f}% shows that {pct:.2f}% of the company's assets are financed through debt, highlighting the leverage level.",
+    "Equity to Fixed Assets Ratio I": "The Equity to Fixed Assets Ratio I of {pct:.2f}% indicates the proportion of equity financing used for non-current assets.",
+    "Equity to Fixed Assets Ratio II": "The Equity to Fixed Assets Ratio II of {pct:.2f}% shows the proportion of equity and long-term liabilities funding non-current assets.",
+    "Effective Debt": "Effective Debt of {value:,.2f} represents the net amount of short and long-term liabilities after considering current assets, highlighting the company's net leverage.",
+    "Static Gearing": "Static Gearing of {value:.2f} indicates the ratio of total liabilities to equity, showing the degree of financial leverage and risk.",
+    "Dynamic Gearing in Years": "Dynamic Gearing in Years of {value} years shows how long it would take to pay off the company's net debt using its operating cash flow.",
+    "Intensity of Inventories": "Inventory Intensity of {pct:.2f}% indicates that {pct:.2f}% of the company's assets are tied up in inventories.",
+    "Working Capital": "Working Capital of {value:,.2f} represents the excess of current assets over short-term liabilities, indicating the company's short-term financial health.",
+    "Property Constitution": "Property Constitution of {pct:.2f}% shows that {pct:.2f}% of the company's assets are non-current, indicating investment in long-term assets.",
+    "Current Ratio": "The Current Ratio of {pct:.2f}% indicates that for every dollar of short-term liabilities, the company has {value:.2f} dollars in current assets, measuring liquidity.",
+    "Quick Ratio": "The Quick Ratio shows that the company can cover {pct:.2f}% of its short-term liabilities with its most liquid assets, excluding inventories.",
+    "Cash Ratio": "The Cash Ratio shows the company's ability to cover {pct:.2f}% of its short-term liabilities with cash and cash equivalents, indicating immediate liquidity.",
+    "Return on Sales": "The Return on Sales of {pct:.2f}% indicates that the company earns {pct:.2f}% net income for every dollar of sales, measuring profitability.",
+    "Return on Assets": "The Return on Assets of {pct:.2f}% shows that the company generates {pct:.2f}% net income for every dollar of assets, assessing asset efficiency.",
+    "Return on Equity": "The Return on Equity of {pct:.2f}% indicates that the company generates {pct:.2f}% net income for every dollar of equity, measuring profitability to shareholders.",
+    "Frequency of Capital Turnover": "The Frequency of Capital Turnover of {value:.2f} times indicates how often the company's assets are converted into sales, assessing asset utilization.",
+    "Return on Investment": "The Return on Investment of {pct:.2f}% shows the company's efficiency in using the combined equity and liabilities to generate profits.",
 }
+_EXPLAINERS = {name: template.format for name, template in KPI_EXPLANATIONS.items()}
+
+def explain_kpis(kpis: dict) -> dict:
+    # Replaces each explained value in a flat KPI map with {"value", "explanation"}, in place.
+    for name, explainer in _EXPLAINERS.items():
+        value = kpis[name]
+        kpis[name] = {"value": value, "explanation": explainer(value=value, pct=value*100)}
+    return kpis
+
+def calculate_kpi_grid(base: Sequence[float], inputs: Mapping[str, np.ndarray], product: bool = True) -> np.ndarray:
+    # KPIs for a base statement with some fields replaced by arrays of input values, either
+    # on a Cartesian grid (one axis per field, in mapping order) or pointwise. Unperturbed
+    # fields stay scalars, so every intermediate that only depends on them (and each sum
+    # over a single perturbed field) is computed once instead of per grid point.
+    # Returns (points, len(KPI_NAMES)), the first field varying slowest.
+    c = [float(value) for value in base]
+    if product:
+        shape = tuple(len(values) for values in inputs.values())
+        for axis, (name, values) in enumerate(inputs.items()):
+            c[FIELD_INDEX[name]] = np.reshape(np.asarray(values, dtype=float), [-1 if i == axis else 1 for i in range(len(shape))])
+    else:
+        shape = (max((len(values) for values in inputs.values()), default=1),)
+        for name, values in inputs.items():
+            c[FIELD_INDEX[name]] = np.asarray(values, dtype=float)
+    out = np.empty(shape + (len(KPI_NAMES),))
+    for i, column in enumerate(kpi_arrays(c)):
+        out[..., i] = column
+    return out.reshape(-1, len(KPI_NAMES))
+
+# Portfolio jobs run in a process pool: KPI_JOB_WORKERS processes (default: one per CPU
+# but one, at least one) at KPI_JOB_NICE lower priority, KPI_JOB_SHARD_SIZE statements
+# per shard, at most KPI_JOB_MAX_JOBS jobs remembered, each for KPI_JOB_TTL seconds after
+# it finishes (0: until evicted). Uploads are spooled to KPI_JOB_DIR (default: the
+# system temporary directory) while their job runs.
+job_manager = JobManager(
+    calculate_kpi_matrix,
+    workers=int(os.environ.get("KPI_JOB_WORKERS", 0)) or None,
+    shard_size=int(os.environ.get("KPI_JOB_SHARD_SIZE", 50000)),
+    max_jobs=int(os.environ.get("KPI_JOB_MAX_JOBS", 100)),
+    niceness=int(os.environ.get("KPI_JOB_NICE", 10)),
+    ttl=float(os.environ.get("KPI_JOB_TTL", 3600)),
+    directory=os.environ.get("KPI_JOB_DIR") or None,
+)
+
+# Peer groups for percentile ranking; KPI_PEER_DIR keeps them on disk across restarts.
+peer_store = PeerStore(KPI_NAMES, directory=os.environ.get("KPI_PEER_DIR") or None)
+# Computed KPIs by company and year, memory-mapped from KPI_SNAPSHOT_DIR and shared by all
+# workers pointed at the same directory. Opened on first use, so importing the module
+# creates no files.
+snapshot_store = LazySnapshotStore("fin_analyst", lambda: KPI_NAMES)
 
 def calculate_earnings(sales_revenues: float, cogs: float) -> float:
     return sales_revenues - cogs
@@ -151,20 +279,491 @@ def calculate_earnings(sales_revenues: float, cogs: float) -> float:
 def calculate_return_on_equity(earnings: float, equity: float) -> float:
     return earnings / equity
 
+def analyze_data(data: FinancialData, explain: bool = True) -> dict:
+    return analyze_values(record_values(data), explain)
+
+def analyze_values(values: Sequence[float], explain: bool = True) -> dict:
+    kpis = dict(zip(KPI_NAMES, calculate_kpi_values(values)))
+    if explain:
+        explain_kpis(kpis)
+    return kpis
+
+# Bulk ingestion limits: records computed per output chunk and longest accepted input line.
+STREAM_CHUNK_RECORDS = 1000
+STREAM_MAX_LINE_BYTES = 1 << 20
+
+async def _iter_lines(stream: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    async for chunk in stream:
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        if len(buffer) > STREAM_MAX_LINE_BYTES:
+            raise ValueError(f"Input line exceeds {STREAM_MAX_LINE_BYTES} bytes.")
+        for line in lines:
+            yield line
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        yield buffer
+
+async def _iter_records(lines: AsyncIterator[str], content_type: str) -> AsyncIterator[tuple]:
+    # Yields (line number, record dict or parse error) for every non-blank input line.
+    header = None
+    number = 0
+    async for line in lines:
+        number += 1
+        line = line.rstrip("\r")
+        if not line.strip():
+            continue
+        if content_type != "text/csv":
+            try:
+                yield number, json.loads(line)
+            except ValueError as e:
+                yield number, e
+        elif header is None:
+            header = [name.strip() for name in next(csv.reader([line]))]
+        else:
+            values = next(csv.reader([line]))
+            yield number, {name: value for name, value in zip(header, values) if value.strip()}
+
+def _analyze_chunk(chunk: List[tuple], explain: bool) -> str:
+    rows = []
+    for number, record in chunk:
+        try:
+            if isinstance(record, Exception):
+                raise record
+            rows.append({"line": number, "kpis": analyze_data(FinancialData.parse_obj(record), explain)})
+        except ValidationError as e:
+            rows.append({"line": number, "error": e.errors()})
+        except ValueError as e:
+            rows.append({"line": number, "error": str(e)})
+    # orjson writes non-finite KPIs as null, as /analyze/fast does: NaN and Infinity are
+    # not JSON and would break strict NDJSON readers.
+    return "".join(orjson.dumps(row).decode() + "\n" for row in rows)
+
+async def _stream_kpis(request: Request, explain: bool) -> AsyncIterator[str]:
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    chunk = []
+    try:
+        async for item in _iter_records(_iter_lines(request.stream()), content_type):
+            chunk.append(item)
+            if len(chunk) >= STREAM_CHUNK_RECORDS:
+                yield await scheduler.run_admitted(_analyze_chunk, chunk, explain)
+                chunk = []
+    except ValueError as e:
+        chunk.append((None, e))
+    if chunk:
+        yield await scheduler.run_admitted(_analyze_chunk, chunk, explain)
+
+class RequestStreamingResponse(StreamingResponse):
+    # StreamingResponse listens for disconnects by draining receive(), which would swallow
+    # the request body the generator is still reading; disconnects surface from the body
+    # stream instead. `release` is called once the response is over, sent or not.
+    def __init__(self, content, release: Optional[Callable[[], None]] = None, **kwargs):
+        super().__init__(content, **kwargs)
+        self.release = release
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await self.stream_response(send)
+        finally:
+            if self.release is not None:
+                self.release()
+        if self.background is not None:
+            await self.background()
+
+# Response encoders per route: (flat KPI list -> body, explained KPI dict -> body).
+_ENCODERS: Dict[str, Tuple[Callable[[list], bytes], Callable[[dict], bytes]]] = {
+    "json": (render_flat_kpis, lambda kpis: JSONResponse({"kpis": kpis}).body),
+    "orjson": (lambda kpis: orjson.dumps({"kpis": dict(zip(KPI_NAMES, kpis))}), lambda kpis: orjson.dumps({"kpis": kpis})),
+}
+
+async def _kpi_response(request: Request, values: Sequence[float], explain: bool, encoding: str, offload: bool = True) -> Response:
+    # Cached response for one statement. The event loop only looks at the in-process
+    # cache; the sqlite level and computing are left to the scheduler, coalescing on the
+    # cache key, or done right here without offload when there is no sqlite level.
+    key = cache_key(values, explain, encoding)
+    body = kpi_cache.get_local(key)
+    mark("cache")
+    if body is None:
+        if offload or kpi_cache.shared:
+            body = await scheduler.run(request, _kpi_body, key, values, explain, encoding, key=key)
+        else:
+            body = _kpi_body(key, values, explain, encoding)
+    return Response(content=body, media_type="application/json")
+
+def _kpi_body(key: str, values: Sequence[float], explain: bool, encoding: str) -> bytes:
+    body = kpi_cache.get(key)
+    mark("cache")
+    if body is not None:
+        return body
+    kpis = calculate_kpi_values(values)
+    mark("compute")
+    if explain:
+        explained = explain_kpis(dict(zip(KPI_NAMES, kpis)))
+        mark("explain")
+        body = _ENCODERS[encoding][1](explained)
+    else:
+        body = _ENCODERS[encoding][0](kpis)
+    mark("encode")
+    kpi_cache.set(key, body)
+    return body
+
 @app.post("/analyze")
-async def analyze_financials(data: FinancialData):
-    kpis = calculate_kpi(
-        data.intangible_assets, data.property_plant_and_equipment, data.other_non_current_assets,
-        data.inventories, data.trade_receivables, data.cash_and_cash_equivalents, data.other_current_assets,
-        data.other_assets, data.active_accruals_deferrals, data.equity, data.short_term_liabilities,
-        data.long_term_liabilities, data.provisions, data.passive_accruals_deferrals, data.sales_revenue,
-        data.changes_in_inventories, data.cogs,data.other_operational_expense, data.depreciation, data.personnel_expenses, data.selling_expenses,
-        data.financial_expenses, data.other_expenses, data.other_operational_income, data.other_income, data.financial_income,
-        data.op_cash_flow
-    )
-    return {
-        "kpis": kpis
-    }
+async def analyze_financials(request: Request, data: FinancialData, explain: bool = True):
+    # FastAPI reads, decodes and validates the body before the handler runs, so this one
+    # "parse" stage covers all three; /analyze/fast times parse and validate separately.
+    mark("parse")
+    return await _kpi_response(request, record_values(data), explain, "json")
+
+def _is_json_content_type(content_type: str) -> bool:
+    main, _, sub = content_type.split(";")[0].strip().lower().partition("/")
+    return main == "application" and (sub == "json" or sub.endswith("+json"))
+
+async def _json_payload(request: Request) -> Any:
+    # Request body decoded the way FastAPI decodes a model body: None when empty, raw bytes
+    # for non-JSON content types, the same 422/400 errors for undecodable bodies. orjson
+    # handles the common case; json (which also accepts NaN/Infinity) everything else.
+    body = await request.body()
+    if not body:
+        return None
+    content_type = request.headers.get("content-type")
+    if content_type and not _is_json_content_type(content_type):
+        return body
+    try:
+        return orjson.loads(body)
+    except orjson.JSONDecodeError:
+        pass
+    try:
+        return json.loads(body)
+    except json.JSONDecodeError as e:
+        raise RequestValidationError(
+            [{"type": "json_invalid", "loc": ("body", e.pos), "msg": "JSON decode error", "input": {}, "ctx": {"error": e.msg}}],
+            body=e.doc,
+        )
+    except Exception:
+        raise HTTPException(status_code=400, detail="There was an error parsing the body")
+
+def parse_financial_values(payload: Any) -> tuple:
+    # FinancialData validation in one pass over the payload, returning a FIELDS-ordered
+    # tuple: pydantic's float coercion (float(value), None rejected), missing fields left at
+    # their defaults, unknown keys ignored, and the same 422 errors in field order.
+    if payload is None:
+        raise RequestValidationError([{"loc": ("body",), "msg": "field required", "type": "value_error.missing"}])
+    if not isinstance(payload, dict):
+        try:
+            payload = dict(payload)
+        except (TypeError, ValueError):
+            raise RequestValidationError([{"loc": ("body",), "msg": "value is not a valid dict", "type": "type_error.dict"}])
+    values = list(FIELD_DEFAULTS)
+    errors = []
+    for name, value in payload.items():
+        i = FIELD_INDEX.get(name)
+        if i is None:
+            continue
+        if type(value) is float:
+            values[i] = value
+        elif value is None:
+            errors.append((i, {"loc": ("body", name), "msg": "none is not an allowed value", "type": "type_error.none.not_allowed"}))
+        else:
+            try:
+                values[i] = float(value)
+            except (TypeError, ValueError):
+                errors.append((i, {"loc": ("body", name), "msg": "value is not a valid float", "type": "type_error.float"}))
+    if errors:
+        raise RequestValidationError([error for _, error in sorted(errors, key=operator.itemgetter(0))])
+    return tuple(values)
+
+@app.post(
+    "/analyze/fast",
+    openapi_extra={"requestBody": {"required": True, "content": {"application/json": {"schema": {"$ref": "#/components/schemas/FinancialData"}}}}},
+)
+async def analyze_financials_fast(request: Request, explain: bool = True):
+    # Same inputs, defaults and validation errors as /analyze, without building a
+    # FinancialData model or leaving the event loop, and encoded with orjson. Non-finite
+    # KPIs (only reachable from NaN/Infinity inputs) are returned as null. One statement
+    # computes in less time than a hop to the scheduler's workers takes, so it skips them.
+    payload = await _json_payload(request)
+    mark("parse")
+    values = parse_financial_values(payload)
+    mark("validate")
+    return await _kpi_response(request, values, explain, "orjson", offload=False)
+
+def batch_matrix(batch: FinancialDataBatch) -> np.ndarray:
+    # FinancialDataBatch as an (n, len(FIELDS)) matrix.
+    if batch.records and batch.columns:
+        raise HTTPException(status_code=422, detail="Provide either records or columns, not both.")
+    if batch.records:
+        return np.array([record_values(record) for record in batch.records], dtype=float)
+    unknown = set(batch.columns) - set(FIELDS)
+    if unknown:
+        raise HTTPException(status_code=422, detail=f"Unknown columns: {', '.join(sorted(unknown))}")
+    if len({len(values) for values in batch.columns.values()}) > 1:
+        raise HTTPException(status_code=422, detail="All columns must have the same length.")
+    values = np.zeros((len(next(iter(batch.columns.values()), [])), len(FIELDS)))
+    for name, column in batch.columns.items():
+        values[:, FIELD_INDEX[name]] = column
+    return values
+
+def kpi_matrix_columns(kpis: np.ndarray) -> Dict[str, np.ndarray]:
+    # An (n, len(KPI_NAMES)) matrix as one contiguous array per KPI, for orjson's
+    # OPT_SERIALIZE_NUMPY (which writes non-finite values as null).
+    return dict(zip(KPI_NAMES, np.ascontiguousarray(kpis.T)))
+
+@app.post(
+    "/analyze/batch",
+    openapi_extra={"requestBody": {"required": True, "content": {"application/json": {"schema": {"$ref": "#/components/schemas/FinancialDataBatch"}}}}},
+)
+async def analyze_financials_batch(request: Request):
+    # Takes a FinancialDataBatch body, decoded and validated in one pass per field by
+    # kpi_kernel.decode_batch instead of one model per statement, and answers with the
+    # KPI columns encoded by orjson from the result matrix.
+    body = await _batch_body(request)
+    return Response(content=await scheduler.run(request, _analyze_batch, body), media_type="application/json")
+
+async def _batch_body(request: Request) -> bytes:
+    # A FinancialDataBatch body for decode_batch. FastAPI validates the raw bytes of a body
+    # sent with a non-JSON content type, which no model accepts.
+    body = await request.body()
+    content_type = request.headers.get("content-type")
+    if body and content_type and not _is_json_content_type(content_type):
+        raise RequestValidationError([{"loc": ("body",), "msg": "value is not a valid dict", "type": "type_error.dict"}])
+    return body
+
+def _analyze_batch(body: bytes) -> bytes:
+    try:
+        values = decode_batch(body, FIELDS)
+    except BatchError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    mark("parse")
+    kpis = calculate_kpi_matrix(values)
+    mark("compute")
+    body = orjson.dumps({"count": len(kpis), "kpis": kpi_matrix_columns(kpis)}, option=orjson.OPT_SERIALIZE_NUMPY)
+    mark("encode")
+    return body
+
+@app.post("/analyze/stream")
+async def analyze_financials_stream(request: Request, explain: bool = False):
+    # Accepts an NDJSON (default) or text/csv body of FinancialData records and streams
+    # one NDJSON row per record back: {"line", "kpis"} or {"line", "error"}. The status
+    # goes out before the first chunk is computed, so the scheduler admits the stream up
+    # front as one request of its client, which it remains until the response is over.
+    return RequestStreamingResponse(_stream_kpis(request, explain), release=scheduler.admit(request),
+                                    media_type="application/x-ndjson")
+
+# Largest grid /analyze/scenarios evaluates in one request. A full 100k-point sweep is a
+# ~17 MB body and ~50 MB peak memory, so the scheduler's concurrent sweeps fit a small dyno.
+KPI_SCENARIO_MAX_POINTS = int(os.environ.get("KPI_SCENARIO_MAX_POINTS", 100_000))
+
+def scenario_inputs(scenario: ScenarioRequest) -> Dict[str, np.ndarray]:
+    # Input values per perturbed field, in request order.
+    base = record_values(scenario.base)
+    inputs = {}
+    points = 1
+    for perturbation in scenario.perturbations:
+        if perturbation.field not in FIELD_INDEX:
+            raise HTTPException(status_code=422, detail=f"Unknown field: {perturbation.field}")
+        if perturbation.field in inputs:
+            raise HTTPException(status_code=422, detail=f"{perturbation.field} is perturbed more than once.")
+        ranged = (perturbation.start, perturbation.stop, perturbation.count)
+        if perturbation.steps and any(value is not None for value in ranged):
+            raise HTTPException(status_code=422, detail=f"{perturbation.field}: give either steps or start/stop/count, not both.")
+        # Checked before any steps are allocated; Python ints, so a product cannot wrap.
+        size = len(perturbation.steps) or perturbation.count or 0
+        points = points * size if scenario.grid == "product" else max(points, size)
+        if points > KPI_SCENARIO_MAX_POINTS:
+            raise HTTPException(status_code=422, detail=f"The grid has more than the limit of {KPI_SCENARIO_MAX_POINTS} points.")
+        if perturbation.steps:
+            steps = np.array(perturbation.steps, dtype=float)
+        elif all(value is not None for value in ranged):
+            steps = np.linspace(*ranged)
+        else:
+            raise HTTPException(status_code=422, detail=f"{perturbation.field}: give steps or start, stop and count.")
+        value = float(base[FIELD_INDEX[perturbation.field]])
+        if perturbation.mode == "relative":
+            inputs[perturbation.field] = value * (1 + steps)
+        elif perturbation.mode == "absolute":
+            inputs[perturbation.field] = value + steps
+        else:
+            inputs[perturbation.field] = steps
+    sizes = [len(values) for values in inputs.values()]
+    if scenario.grid == "zip" and len(set(sizes)) > 1:
+        raise HTTPException(status_code=422, detail="zip grids need the same number of steps for every perturbation.")
+    return inputs
+
+@app.post("/analyze/scenarios")
+async def analyze_scenarios(request: Request, scenario: ScenarioRequest):
+    # Sensitivity sweep over a base statement. Returns the input values per perturbed field
+    # ("axes") and the grid shape; KPIs that come out the same at every point are returned
+    # once under "constants", the others as "kpis" names plus one "values" row per grid
+    # point, in row-major order over the axes (for zip grids: one row per step).
+    mark("parse")
+    return Response(content=await scheduler.run(request, _scenario_body, scenario), media_type="application/json")
+
+def _scenario_body(scenario: ScenarioRequest) -> bytes:
+    names = scenario.kpis or list(KPI_NAMES)
+    unknown = set(names) - set(KPI_INDEX)
+    if unknown:
+        raise HTTPException(status_code=422, detail=f"Unknown KPIs: {', '.join(sorted(unknown))}")
+    inputs = scenario_inputs(scenario)
+    kpis = calculate_kpi_grid(record_values(scenario.base), inputs, product=scenario.grid == "product")
+    if scenario.kpis:
+        kpis = kpis[:, [KPI_INDEX[name] for name in names]]
+    varying = (kpis != kpis[:1]).any(axis=0)
+    mark("compute")
+    shape = [len(values) for values in inputs.values()] if scenario.grid == "product" else [len(kpis)]
+    body = orjson.dumps({
+        "grid": scenario.grid,
+        "axes": inputs,
+        "shape": shape,
+        "constants": {name: float(kpis[0, i]) for i, name in enumerate(names) if not varying[i]},
+        "kpis": [name for i, name in enumerate(names) if varying[i]],
+        "values": np.ascontiguousarray(kpis[:, varying]),
+    }, option=orjson.OPT_SERIALIZE_NUMPY)
+    mark("encode")
+    return body
+
+@app.post("/jobs", status_code=202)
+async def submit_job(request: Request):
+    # Takes a FinancialDataBatch body. A job worker process decodes and validates it and
+    # spools the statements to a file the shards map, so a multi-million statement upload
+    # holds neither the event loop nor this process's GIL, and never its memory.
+    body = await _batch_body(request)
+    try:
+        path, rows = await asyncio.wrap_future(job_manager.spool(decode_batch, body, FIELDS))
+    except BatchError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    job = job_manager.submit_spooled(path, rows)
+    return {"id": job.id, "status": job.status, "rows": job.rows, "shards": job.shards}
+
+# Most shards one GET /jobs/{job_id} returns, so a poll of a large job stays short.
+KPI_JOB_POLL_SHARDS = int(os.environ.get("KPI_JOB_POLL_SHARDS", 2))
+
+@app.get("/jobs/{job_id}")
+def read_job(job_id: str, since: int = Query(0, ge=0)):
+    # Returns up to KPI_JOB_POLL_SHARDS of the shards completed after the first `since`
+    # ones, in completion order, so clients poll with since=next to collect results as they
+    # arrive. Encoded with orjson straight from the shard arrays; non-finite KPIs are null.
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id}.")
+    # Shards can complete meanwhile: slice up to the count that is reported.
+    completed = len(job.results)
+    results = job.results[since:min(completed, since + KPI_JOB_POLL_SHARDS)]
+    body = orjson.dumps({
+        "id": job.id,
+        "status": job.status,
+        "rows": job.rows,
+        "shards": job.shards,
+        "completed": completed,
+        "next": min(since, completed) + len(results),
+        "errors": job.errors,
+        "results": [
+            {"shard": shard, "offset": offset, "kpis": kpi_matrix_columns(kpis)}
+            for shard, offset, kpis in results
+        ],
+    }, option=orjson.OPT_SERIALIZE_NUMPY)
+    return Response(content=body, media_type="application/json")
+
+@app.delete("/jobs/{job_id}")
+def delete_job(job_id: str):
+    # Frees a job's results without waiting for KPI_JOB_TTL; a running job is cancelled.
+    if not job_manager.delete(job_id):
+        raise HTTPException(status_code=404, detail=f"Unknown job {job_id}.")
+    return {"id": job_id, "deleted": True}
+
+@app.get("/peers")
+def read_peer_groups():
+    return {"groups": peer_store.groups()}
+
+@app.post("/peers/{group}")
+async def add_peers(request: Request, group: str, batch: FinancialDataBatch):
+    return await scheduler.run(request, _add_peers, group, batch, coalesce=False)
+
+def _add_peers(group: str, batch: FinancialDataBatch) -> dict:
+    try:
+        added = peer_store.add(group, calculate_kpi_matrix(batch_matrix(batch)))
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return {"group": group, "added": added, "count": peer_store.groups()[group]}
+
+@app.delete("/peers/{group}")
+def delete_peers(group: str):
+    try:
+        peer_store.remove(group)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return {"group": group, "deleted": True}
+
+@app.get("/peers/{group}/summary")
+def read_peer_summary(group: str):
+    try:
+        return {"group": group, **peer_store.summary(group)}
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+@app.post("/peers/{group}/rank")
+def rank_against_peers(group: str, data: FinancialData):
+    kpis = analyze_data(data, explain=False)
+    try:
+        percentiles = peer_store.rank(group, kpis)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    # orjson: KPIs of NaN/Infinity inputs come out as null rather than failing the response.
+    return Response(content=orjson.dumps({"group": group, "kpis": kpis, "percentiles": percentiles}), media_type="application/json")
+
+def _snapshot_response(content: dict) -> Response:
+    return Response(content=orjson.dumps(content), media_type="application/json")
+
+@app.post("/kpis")
+async def store_kpis(request: Request, batch: CompanyFinancialDataBatch):
+    # Computes and stores the KPIs of many company-years in one append.
+    return await scheduler.run(request, _store_kpis, batch, coalesce=False)
+
+def _store_kpis(batch: CompanyFinancialDataBatch) -> dict:
+    kpis = calculate_kpi_matrix(np.array([record_values(record) for record in batch.records], dtype=float))
+    try:
+        stored = snapshot_store().append([record.company for record in batch.records], [record.year for record in batch.records], kpis)
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return {"stored": stored, "count": snapshot_store().count()}
+
+@app.post("/kpis/{company}/{year}")
+def store_company_kpis(company: str, year: int = Path(..., ge=MIN_YEAR, le=MAX_YEAR), data: FinancialData = FinancialData()):
+    kpis = calculate_kpi_values(record_values(data))
+    try:
+        snapshot_store().append([company], [year], np.array([kpis], dtype=float))
+    except ValueError as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    return _snapshot_response({"company": company, "year": year, "kpis": dict(zip(KPI_NAMES, kpis))})
+
+@app.get("/kpis/{company}/{year}")
+async def read_company_kpis(company: str, year: int):
+    kpis = await snapshot_store.get(company, year)
+    return _snapshot_response({"company": company, "year": year, "kpis": kpis})
+
+@app.get("/kpis/{company}")
+async def scan_company_kpis(company: str, start_year: Optional[int] = None, end_year: Optional[int] = None):
+    # Stored years of a company within [start_year, end_year], oldest first, as columns.
+    columns = await snapshot_store.scan(company, start_year, end_year)
+    years = columns.pop("year")
+    return _snapshot_response({"company": company, "count": len(years), "year": years, "kpis": columns})
+
+def _service_metrics() -> str:
+    stats = kpi_cache.stats()
+    return scheduler.prometheus() + "".join([
+        prometheus_metric("kpi_cache_hits_total", "counter", "Responses served from the in-process cache.", stats["hits"]),
+        prometheus_metric("kpi_cache_shared_hits_total", "counter", "Responses served from the shared sqlite cache.", stats["shared_hits"]),
+        prometheus_metric("kpi_cache_misses_total", "counter", "Responses computed because no cache had them.", stats["misses"]),
+        prometheus_metric("kpi_cache_evictions_total", "counter", "Entries evicted from the in-process cache.", stats["evictions"]),
+        prometheus_metric("kpi_cache_shared_evictions_total", "counter", "Expired or excess rows deleted from the shared sqlite cache.", stats["shared_evictions"]),
+        prometheus_metric("kpi_cache_entries", "gauge", "Entries in the in-process cache.", stats["size"]),
+        prometheus_metric("kpi_cache_max_entries", "gauge", "Capacity of the in-process cache.", stats["maxsize"]),
+    ])
+
+# Request instrumentation (kpi_metrics): stage timings and the cache and scheduler metrics
+# at /metrics, sampled request logs and profiles as configured by the environment.
+stage_metrics, profiler = instrument_from_env(app, extra_metrics=_service_metrics)
 
 @app.get("/")
 def read_root():
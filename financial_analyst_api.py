@@ -2,12 +2,17 @@
 
 import base64
 import requests
+import numpy as np
 import pandas as pd
 import io
 from io import StringIO
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request
 from pydantic import BaseModel, ValidationError
-from typing import Dict, TypedDict, Optional
+from typing import Dict, List, TypedDict, Optional
+from kpi_metrics import annotate, instrument_from_env, mark
+from kpi_scheduler import Scheduler
+from kpi_snapshots import LazySnapshotStore
+from kpi_timeseries import TimeSeriesPanel, frame_to_columns
 
 
 
@@ -24,6 +29,13 @@ app = FastAPI(
         ]
             )
 
+# Same scheduling settings as fin_analyst_api: a bounded worker pool with queue and
+# per-client limits, identical requests in flight computed once.
+scheduler = Scheduler.from_env()
+
+# Same request instrumentation as fin_analyst_api, with the scheduler metrics at /metrics.
+stage_metrics, profiler = instrument_from_env(app, extra_metrics=scheduler.prometheus)
+
 @app.get("/")
 def read_root():
     return """
@@ -75,15 +87,41 @@ def submit_data(input_data: FinancialFigures):
     return {"message": "Data received successfully"}
 
 @app.post("/calculateKPIs")
-def api_calculate_kpis(input_data: FinancialFigures):
-    # Debug print to check the structure of input_data
-    print("Type of input_data:", type(input_data))
-    print("Keys in input_data.data:", input_data.data.keys())
+async def api_calculate_kpis(request: Request, input_data: FinancialFigures, company: Optional[str] = None):
+    mark("parse")
+    # Goes to the sampled request log instead of stdout.
+    annotate(years=list(input_data.data))
+    return await scheduler.run(request, _calculate_and_store_kpis, input_data, company)
 
+def _calculate_and_store_kpis(input_data: FinancialFigures, company: Optional[str]) -> Dict[str, Dict[str, float]]:
     # Call the simplified calculate_kpis function
     kpi_results = calculate_kpis(input_data.data)
+    mark("compute")
+    if company is not None:
+        # Keeps the per-year results for GET /kpis/{company}; years must be integers.
+        try:
+            years = [int(year) for year in kpi_results]
+            kpis = np.array([list(kpis.values()) for kpis in kpi_results.values()], dtype=float)
+            snapshot_store().append([company] * len(years), years, kpis)
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=f"Cannot store KPIs for {company!r}: {str(e)}")
+        mark("store")
     return kpi_results
 
+# The KPI names come from calculate_kpis itself.
+snapshot_store = LazySnapshotStore("financial_analyst", lambda: list(calculate_kpis({"": {}})[""]))
+
+@app.get("/kpis/{company}/{year}")
+async def api_read_kpis(company: str, year: int):
+    return await snapshot_store.get(company, year)
+
+@app.get("/kpis/{company}")
+async def api_scan_kpis(company: str, start_year: Optional[int] = None, end_year: Optional[int] = None):
+    # {year: {KPI: value}} for the stored years within [start_year, end_year].
+    columns = await snapshot_store.scan(company, start_year, end_year)
+    years = columns.pop("year")
+    return {str(year): {name: values[i] for name, values in columns.items()} for i, year in enumerate(years)}
+
 # @app.post("/calculateKPIs")
 # def api_calculate_kpis(input_data: FinancialFigures):
 #     try:
@@ -149,6 +187,106 @@ def calculate_kpis(financial_data: Dict[str, FinancialDetails]) -> Dict[str, Dic
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Unexpected error calculating KPIs: {str(e)}")
 
+def _divide(numerator, denominator, guard=None) -> np.ndarray:
+    guard = denominator != 0 if guard is None else guard & (denominator != 0)
+    return np.divide(numerator, denominator, out=np.zeros(len(numerator)), where=guard)
+
+def calculate_kpis_frame(frame: pd.DataFrame) -> pd.DataFrame:
+    # Vectorized counterpart of calculate_kpis: one row per company-year in, one row of KPIs out.
+    d = {name: frame[name].to_numpy(dtype=float) if name in frame else np.zeros(len(frame)) for name in FinancialDetails.__annotations__}
+    d = {name: np.nan_to_num(values, nan=0.0) for name, values in d.items()}
+    equity = d['equity']
+    inventories = d['inventories']
+    non_current_assets = d['intangible_assets'] + d['property_plant_and_equipment'] + d['other_non_current_assets']
+    current_assets = d['cash_and_cash_equivalents'] + d['trade_receivables'] + d['other_current_assets']
+    total_assets = non_current_assets + current_assets + d['other_assets'] + d['active_accruals_deferrals']
+    short_term_liabilities = d['short_term_and_current_liabilities']
+    long_term_liabilities = d['long_term_debt_and_non_current_liabilities']
+    total_liabilities = short_term_liabilities + long_term_liabilities + d['provisions'] + d['passive_accruals_deferrals']
+    sales_revenue = d['sales_revenue']
+    ebitda = sales_revenue - d['cogs']
+    ebit = ebitda - d['depreciation']
+    net_income = ebit - d['other_operational_expense'] + d['other_operational_income'] - d['interest_expenses'] + d['interest_income'] - d['other_expenses'] + d['other_income']
+    op_cash_flow = d['op_cash_flow']
+
+    return pd.DataFrame({
+        'Total Assets': total_assets,
+        'Total Liabilities': total_liabilities,
+        'EBITDA': ebitda,
+        'EBIT': ebit,
+        'Net Income': net_income,
+        'Equity Ratio': _divide(equity, total_assets),
+        'Debt Ratio': _divide(total_liabilities, total_assets),
+        'Equity-to-Fixed Assets Ratio I': _divide(equity, non_current_assets),
+        'Equity-to-Fixed Assets Ratio II': _divide(equity, non_current_assets + long_term_liabilities, non_current_assets != 0),
+        'Effective Debt': (short_term_liabilities + long_term_liabilities) - current_assets,
+        'Static Gearing': _divide(total_liabilities, equity),
+        'Dynamic Gearing in years': _divide(short_term_liabilities + long_term_liabilities - current_assets, op_cash_flow),
+        'Intensity of Inventories': _divide(inventories, total_assets),
+        'Working Capital': current_assets - short_term_liabilities,
+        'Property Constitution': _divide(non_current_assets, total_assets),
+        'Current Ratio': _divide(current_assets, short_term_liabilities),
+        'Quick Ratio': _divide(current_assets - inventories, short_term_liabilities),
+        'Cash Ratio': _divide(current_assets, short_term_liabilities),
+        'Return on Sales': _divide(net_income, sales_revenue),
+        'Return on Assets': _divide(net_income, total_assets),
+        'Return on Equity': _divide(net_income, equity),
+        'Frequency of Capital Turnover': _divide(sales_revenue, total_assets),
+        'Return on Investment': _divide(net_income, equity + total_liabilities),
+    }, index=frame.index)
+
+def new_time_series_panel() -> TimeSeriesPanel:
+    return TimeSeriesPanel(
+        calculate_kpis_frame,
+        growth_columns=['sales_revenue', 'EBITDA', 'EBIT', 'Net Income', 'Total Assets', 'equity'],
+        average_balances={
+            'Return on Average Equity': ('Net Income', 'equity'),
+            'Return on Average Assets': ('Net Income', 'Total Assets'),
+        },
+    )
+
+# Company histories kept between requests for incremental /timeSeries/append updates.
+time_series_panel = new_time_series_panel()
+
+class FinancialHistory(BaseModel):
+    company: List[str]
+    year: List[int]
+    columns: Dict[str, List[Optional[float]]] = {}
+
+def _history_frame(history: FinancialHistory) -> pd.DataFrame:
+    unknown = set(history.columns) - set(FinancialDetails.__annotations__)
+    if unknown:
+        raise HTTPException(status_code=422, detail=f"Unknown columns: {', '.join(sorted(unknown))}")
+    if any(len(values) != len(history.company) for values in [history.year, *history.columns.values()]):
+        raise HTTPException(status_code=422, detail="company, year and all columns must have the same length.")
+    frame = pd.DataFrame({name: np.asarray(values, dtype=float) for name, values in history.columns.items()},
+                         columns=list(FinancialDetails.__annotations__))
+    frame.index = pd.MultiIndex.from_arrays([history.company, history.year], names=['company', 'year'])
+    return frame
+
+@app.post("/calculateTimeSeries")
+async def api_calculate_time_series(request: Request, history: FinancialHistory):
+    return await scheduler.run(request, _calculate_time_series, history)
+
+def _calculate_time_series(history: FinancialHistory) -> dict:
+    kpis, summary = new_time_series_panel().compute(_history_frame(history))
+    return {"kpis": frame_to_columns(kpis), "summary": frame_to_columns(summary)}
+
+@app.post("/timeSeries/append")
+async def api_append_time_series(request: Request, history: FinancialHistory):
+    return await scheduler.run(request, _append_time_series, history, coalesce=False)
+
+def _append_time_series(history: FinancialHistory) -> dict:
+    kpis, summary = time_series_panel.append(_history_frame(history))
+    return {"kpis": frame_to_columns(kpis), "summary": frame_to_columns(summary)}
+
+@app.get("/timeSeries/{company}")
+def api_read_time_series(company: str):
+    if company not in time_series_panel:
+        raise HTTPException(status_code=404, detail=f"No history stored for {company}.")
+    kpis, summary = time_series_panel.history(company)
+    return {"kpis": frame_to_columns(kpis), "summary": frame_to_columns(summary)}
+
 if __name__ == "__main__":
     # Placeholder for server start, actual server running code would be needed here
     pass
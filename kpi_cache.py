@@ -0,0 +1,133 @@
+import hashlib
+import sqlite3
+import struct
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Sequence
+
+
+def cache_key(values: Sequence[float], *options) -> str:
+    # Canonical key: the exact IEEE-754 bytes of the inputs, which of them are floats (an
+    # unset field's int 0 default renders as 0, an explicit 0.0 as 0.0), plus any response
+    # options.
+    packed = (struct.pack(f"<{len(values)}d", *values) + bytes([type(value) is float for value in values])
+              + repr(options).encode())
+    return hashlib.blake2b(packed, digest_size=16).hexdigest()
+
+
+class KPICache:
+    # In-process LRU of serialized responses with an optional TTL and an optional
+    # sqlite file shared between worker processes as a second level. The sqlite level keeps
+    # at most shared_maxsize rows (0: unbounded): every PRUNE_EVERY inserts, expired rows
+    # and the oldest rows beyond the limit are deleted. The levels have separate locks, so
+    # get_local never waits for a sqlite write.
+    PRUNE_EVERY = 256
+
+    def __init__(self, maxsize: int = 4096, ttl: float = 0, path: Optional[str] = None, shared_maxsize: int = 100_000):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.path = path
+        self.shared_maxsize = shared_maxsize
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.shared_evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._db_lock = threading.Lock()
+        self._inserts = 0
+        if path:
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            # A lost cache row is only recomputed: no need to fsync every insert.
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS kpi_cache (key TEXT PRIMARY KEY, created REAL, body BLOB)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS kpi_cache_created ON kpi_cache (created)")
+
+    @property
+    def shared(self) -> bool:
+        return self._db is not None
+
+    def _expired(self, created: float) -> bool:
+        return bool(self.ttl) and time.time() - created > self.ttl
+
+    def _store(self, key: str, created: float, body: bytes) -> None:
+        self._entries[key] = (created, body)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get_local(self, key: str) -> Optional[bytes]:
+        # The in-process level only; a miss here is not counted, get() decides that.
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if not self._expired(entry[0]):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self._entries[key]
+            return None
+
+    def get(self, key: str) -> Optional[bytes]:
+        body = self.get_local(key)
+        if body is not None:
+            return body
+        if self._db is not None:
+            with self._db_lock:
+                row = self._db.execute("SELECT created, body FROM kpi_cache WHERE key = ?", (key,)).fetchone()
+            if row is not None and not self._expired(row[0]):
+                with self._lock:
+                    if self.maxsize > 0:
+                        self._store(key, row[0], row[1])
+                    self.shared_hits += 1
+                return row[1]
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def set(self, key: str, body: bytes) -> None:
+        created = time.time()
+        if self.maxsize > 0:
+            with self._lock:
+                self._store(key, created, body)
+        if self._db is not None:
+            with self._db_lock:
+                self._db.execute("INSERT OR REPLACE INTO kpi_cache (key, created, body) VALUES (?, ?, ?)", (key, created, body))
+                self._inserts += 1
+                if self._inserts % self.PRUNE_EVERY == 0:
+                    self._prune()
+
+    def _prune(self) -> None:
+        if self.ttl:
+            self.shared_evictions += self._db.execute("DELETE FROM kpi_cache WHERE created < ?", (time.time() - self.ttl,)).rowcount
+        if self.shared_maxsize > 0:
+            self.shared_evictions += self._db.execute(
+                "DELETE FROM kpi_cache WHERE key IN (SELECT key FROM kpi_cache ORDER BY created DESC LIMIT -1 OFFSET ?)",
+                (self.shared_maxsize,)).rowcount
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+        if self._db is not None:
+            with self._db_lock:
+                self._db.execute("DELETE FROM kpi_cache")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "shared_evictions": self.shared_evictions,
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "shared_maxsize": self.shared_maxsize,
+                "ttl": self.ttl,
+                "shared_backend": self.path,
+            }
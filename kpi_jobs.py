@@ -0,0 +1,176 @@
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import CancelledError, Future, ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+class Job:
+    def __init__(self, job_id: str, rows: int, shards: int):
+        self.id = job_id
+        self.rows = rows
+        self.shards = shards
+        self.created = time.time()
+        self.finished: Optional[float] = None
+        self.futures: List[Future] = []
+        # Completed shards in completion order: (shard number, first row, result columns).
+        self.results: List[tuple] = []
+        self.errors: List[dict] = []
+        # Spooled inputs the shards map (see JobManager.spool), removed once the job is done.
+        self.path: Optional[str] = None
+        # Set once every shard's result or error is recorded.
+        self.done = threading.Event()
+
+    @property
+    def status(self) -> str:
+        if len(self.results) + len(self.errors) < self.shards:
+            return "running"
+        return "failed" if self.errors else "done"
+
+
+class JobManager:
+    # Splits large portfolios (one row per statement) into row shards and computes them in
+    # a process pool. The pool is started on the first submission and reused; shard results
+    # are kept as arrays and handed out in completion order. By default the pool leaves one
+    # CPU to the API, and its processes run at a lower priority (niceness added to the
+    # parent's), so a job does not slow down single requests. Finished jobs are forgotten
+    # ttl seconds after they finish (0: never) or when more than max_jobs are kept, oldest
+    # first, or when they are deleted.
+    def __init__(self, function: Callable[[np.ndarray], np.ndarray],
+                 workers: Optional[int] = None, shard_size: int = 50000, max_jobs: int = 100,
+                 niceness: int = 10, ttl: float = 3600, directory: Optional[str] = None):
+        self.function = function
+        self.workers = workers or max(1, (os.cpu_count() or 1) - 1)
+        self.niceness = niceness
+        self.shard_size = shard_size
+        self.max_jobs = max_jobs
+        self.ttl = ttl
+        self.directory = directory or tempfile.gettempdir()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._jobs: Dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # spawn: forking a process that runs uvicorn's threads is not safe.
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+                                                     initializer=_lower_priority, initargs=(self.niceness,))
+            return self._executor
+
+    def submit(self, values: np.ndarray) -> Job:
+        # A job over an in-process matrix: each shard is pickled to its worker.
+        return self._start(len(values), None, lambda start, stop: (self.function, values[start:stop]))
+
+    def spool(self, decode: Callable[..., np.ndarray], *args) -> Future:
+        # Runs decode(*args) in the pool and saves the matrix it returns to an .npy file in
+        # `directory`, so an upload is decoded without passing through this process: the
+        # future's result is (path, rows), for submit_spooled.
+        return self.executor.submit(_spool, self.directory, decode, *args)
+
+    def submit_spooled(self, path: str, rows: int) -> Job:
+        # A job over a spooled matrix: each worker maps its own rows of the file, which is
+        # removed when the job is done or deleted.
+        return self._start(rows, path, lambda start, stop: (_map_rows, self.function, path, start, stop))
+
+    def _start(self, rows: int, path: Optional[str], shard_call: Callable[[int, int], tuple]) -> Job:
+        starts = range(0, rows, self.shard_size)
+        job = Job(uuid.uuid4().hex, rows, len(starts))
+        job.path = path
+        with self._lock:
+            self._forget_finished()
+            self._jobs[job.id] = job
+        executor = self.executor
+        for shard, start in enumerate(starts):
+            future = executor.submit(*shard_call(start, start + self.shard_size))
+            future.add_done_callback(lambda future, shard=shard, start=start: self._complete(job, shard, start, future))
+            job.futures.append(future)
+        if not job.shards:
+            job.finished = time.time()
+            _remove(path)
+            job.done.set()
+        return job
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            self._forget_finished(keep=self.max_jobs)
+            return self._jobs.get(job_id)
+
+    def delete(self, job_id: str) -> bool:
+        # Forgets a job, cancelling its shards that have not started. Shards already running
+        # finish into the forgotten job.
+        with self._lock:
+            job = self._jobs.pop(job_id, None)
+        if job is None:
+            return False
+        # Outside the lock: cancelling runs the shards' done callbacks, which take it.
+        for future in job.futures:
+            future.cancel()
+        _remove(job.path)
+        return True
+
+    def wait(self, job: Job, timeout: Optional[float] = None) -> bool:
+        # Futures wake their waiters before running done callbacks, so this waits for the
+        # callbacks that record the shards instead.
+        return job.done.wait(timeout)
+
+    def shutdown(self) -> None:
+        # Waits outside the lock: the callbacks of running shards take it.
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+
+    def _complete(self, job: Job, shard: int, start: int, future: Future) -> None:
+        with self._lock:
+            error = CancelledError() if future.cancelled() else future.exception()
+            if error is None:
+                job.results.append((shard, start, future.result()))
+            else:
+                job.errors.append({"shard": shard, "offset": start, "error": repr(error)})
+            if job.status != "running":
+                job.finished = time.time()
+                _remove(job.path)
+                job.done.set()
+
+    def _forget_finished(self, keep: Optional[int] = None) -> None:
+        # Drops expired jobs and the oldest finished ones beyond `keep` (by default room for
+        # one more job).
+        keep = self.max_jobs - 1 if keep is None else keep
+        finished = sorted((job for job in self._jobs.values() if job.finished), key=lambda job: job.finished)
+        excess = max(0, len(self._jobs) - keep)
+        for i, job in enumerate(finished):
+            if i >= excess and not (self.ttl and time.time() - job.finished > self.ttl):
+                break
+            del self._jobs[job.id]
+
+
+def _spool(directory: str, decode: Callable[..., np.ndarray], *args) -> Tuple[str, int]:
+    values = decode(*args)
+    descriptor, path = tempfile.mkstemp(prefix="kpi-job-", suffix=".npy", dir=directory)
+    with os.fdopen(descriptor, "wb") as file:
+        np.save(file, values)
+    return path, len(values)
+
+
+def _map_rows(function: Callable[[np.ndarray], np.ndarray], path: str, start: int, stop: int) -> np.ndarray:
+    return function(np.load(path, mmap_mode="r")[start:stop])
+
+
+def _remove(path: Optional[str]) -> None:
+    if path is not None:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _lower_priority(niceness: int) -> None:
+    if niceness and hasattr(os, "nice"):
+        os.nice(niceness)
@@ -0,0 +1,257 @@
+import json
+
+import numpy as np
+import orjson
+from typing import Callable, Optional, Sequence
+
+# The KPI formulas over numpy arrays and the decoding of job uploads, without the API
+# around them: importing this module has no side effects, so process pool workers can
+# import it cheaply.
+
+KPI_NAMES = (
+    "non-current assets",
+    "current assets",
+    "total assets",
+    "equity",
+    "long-term liabilities",
+    "short-term liabilities",
+    "total liabilities",
+    "Sales revenue",
+    "changes in inventory:",
+    "cost of goods sold (COGS)",
+    "other operational expenses",
+    "EBITDA",
+    "depreciation and amortization",
+    "EBIT",
+    "Net Income",
+    "Equity Ratio",
+    "Debt Ratio",
+    "Equity to Fixed Assets Ratio I",
+    "Equity to Fixed Assets Ratio II",
+    "Effective Debt",
+    "Static Gearing",
+    "Dynamic Gearing in Years",
+    "Intensity of Inventories",
+    "Working Capital",
+    "Property Constitution",
+    "Current Ratio",
+    "Quick Ratio",
+    "Cash Ratio",
+    "Return on Sales",
+    "Return on Assets",
+    "Return on Equity",
+    "Frequency of Capital Turnover",
+    "Return on Investment",
+)
+
+def _round(values: np.ndarray, ndigits: int) -> np.ndarray:
+    # np.round agrees with the builtin round except where x * 10**ndigits lands
+    # next to a .5 tie, so those few elements are re-rounded in Python.
+    rounded = np.round(values, ndigits)
+    scaled = values * 10.0 ** ndigits
+    fraction = np.abs(scaled - np.floor(scaled) - 0.5)
+    suspect = (fraction <= np.abs(scaled) * 1e-15 + 1e-9) | ~np.isfinite(scaled)
+    for i in np.flatnonzero(suspect):
+        rounded.flat[i] = round(float(values.flat[i]), ndigits)
+    return rounded
+
+def _ratio(numerator, denominator, ndigits: int) -> np.ndarray:
+    numerator, denominator = np.broadcast_arrays(np.asarray(numerator, dtype=float), np.asarray(denominator, dtype=float))
+    result = np.divide(numerator, denominator, out=np.zeros(numerator.shape), where=denominator != 0)
+    return _round(result, ndigits)
+
+def kpi_arrays(c: Sequence) -> list:
+    # Vectorized counterpart of fin_analyst_api.calculate_kpi_values: c holds one array
+    # (or scalar) per FinancialData field in declaration order; returns one array per KPI
+    # in KPI_NAMES order. Scalars broadcast, so intermediates that only depend on scalar
+    # inputs are computed once.
+    (intangible_assets, property_plant_and_equipment, other_non_current_assets, inventories, trade_receivables,
+     cash_and_cash_equivalents, other_current_assets, other_assets, active_accruals_deferrals, equity,
+     short_term_liabilities, long_term_liabilities, provisions, passive_accruals_deferrals, sales_revenue,
+     changes_in_inventories, cogs, other_operational_expense, depreciation, personnel_expenses, selling_expenses,
+     financial_expenses, other_expenses, other_operational_income, other_income, financial_income, op_cash_flow) = c
+
+    non_current_assets = intangible_assets + property_plant_and_equipment + other_non_current_assets
+    current_assets = inventories + trade_receivables + cash_and_cash_equivalents + other_current_assets
+    total_assets = non_current_assets + current_assets + other_assets + active_accruals_deferrals
+    total_liabilities = short_term_liabilities + long_term_liabilities
+    other_operational_expenses = other_operational_expense + np.abs(selling_expenses) + np.abs(personnel_expenses)
+    ebitda = sales_revenue + changes_in_inventories - np.abs(cogs) - np.abs(other_operational_expenses) + other_operational_income
+    ebit = ebitda - np.abs(depreciation)
+    net_income = ebit - np.abs(financial_expenses) + financial_income - np.abs(other_expenses) + other_income
+    effective_debt = total_liabilities - current_assets
+
+    return [
+        non_current_assets,
+        current_assets,
+        total_assets,
+        equity,
+        long_term_liabilities,
+        short_term_liabilities,
+        total_liabilities,
+        sales_revenue,
+        changes_in_inventories,
+        cogs,
+        other_operational_expenses,
+        ebitda,
+        depreciation,
+        ebit,
+        net_income,
+        _ratio(equity, total_assets, 4),
+        _ratio(total_liabilities, total_assets, 4),
+        _ratio(equity, non_current_assets, 4),
+        _ratio(equity, non_current_assets + long_term_liabilities, 4),
+        effective_debt,
+        _ratio(total_liabilities, equity, 4),
+        _ratio(effective_debt, op_cash_flow, 1),
+        _ratio(inventories, total_assets, 4),
+        current_assets - short_term_liabilities,
+        _ratio(non_current_assets, total_assets, 4),
+        _ratio(current_assets, short_term_liabilities, 4),
+        _ratio(current_assets - inventories, short_term_liabilities, 4),
+        _ratio(cash_and_cash_equivalents, short_term_liabilities, 4),
+        _ratio(net_income, sales_revenue, 4),
+        _ratio(net_income, total_assets, 4),
+        _ratio(net_income, equity, 4),
+        _ratio(sales_revenue, total_assets, 1),
+        _ratio(net_income, equity + total_liabilities, 4),
+    ]
+
+def calculate_kpi_matrix(values: np.ndarray, out: Optional[np.ndarray] = None) -> np.ndarray:
+    # (n, len(FIELDS)) inputs to (n, len(KPI_NAMES)) KPIs, written into `out` when given.
+    if out is None:
+        out = np.empty((len(values), len(KPI_NAMES)))
+    for i, column in enumerate(kpi_arrays(values.T)):
+        out[:, i] = column
+    return out
+
+class BatchError(ValueError):
+    # A body decode_batch rejects, with the status and detail FastAPI answers it with.
+    def __init__(self, status_code: int, detail):
+        super().__init__(status_code, detail)
+        self.status_code = status_code
+        self.detail = detail
+
+def _error(loc: tuple, msg: str, type_: str) -> dict:
+    return {"loc": loc, "msg": msg, "type": type_}
+
+def _none(loc: tuple) -> dict:
+    return _error(loc, "none is not an allowed value", "type_error.none.not_allowed")
+
+def _fill(out: np.ndarray, column: list, loc: Callable[[int], tuple]) -> list:
+    # Converts a list of JSON values into `out` with pydantic's float coercion, returning
+    # the errors. One bulk assignment; the per-value pass only runs to report failures.
+    if None not in column:
+        try:
+            out[:] = column
+            return []
+        except (TypeError, ValueError):
+            pass
+    errors = []
+    for i, value in enumerate(column):
+        if value is None:
+            errors.append(_none(loc(i)))
+            continue
+        try:
+            out[i] = float(value)
+        except (TypeError, ValueError):
+            errors.append(_error(loc(i), "value is not a valid float", "type_error.float"))
+    return errors
+
+def _load_json(body: bytes):
+    # The body decoded as FastAPI decodes a JSON model body, with its errors. orjson handles
+    # the common case; json (which also accepts NaN, Infinity and overflowing numbers, as
+    # FastAPI does) everything else.
+    try:
+        return orjson.loads(body)
+    except orjson.JSONDecodeError:
+        pass
+    try:
+        return json.loads(body)
+    except json.JSONDecodeError as e:
+        raise BatchError(422, [{"type": "json_invalid", "loc": ("body", e.pos), "msg": "JSON decode error", "input": {}, "ctx": {"error": e.msg}}])
+    except Exception:
+        raise BatchError(400, "There was an error parsing the body")
+
+def _records(records, fields: Sequence[str]) -> tuple:
+    # (matrix, errors) of FinancialDataBatch.records: errors per statement, in field order.
+    if records is None:
+        return None, [_none(("body", "records"))]
+    if not isinstance(records, list):
+        return None, [_error(("body", "records"), "value is not a valid list", "type_error.list")]
+    errors = []
+    for i, record in enumerate(records):
+        if record is None:
+            errors.append(((i, -1), _none(("body", "records", i))))
+        elif not isinstance(record, dict):
+            try:
+                records[i] = dict(record)
+            except (TypeError, ValueError):
+                errors.append(((i, -1), _error(("body", "records", i), "value is not a valid dict", "type_error.dict")))
+    if errors:
+        records = [record if isinstance(record, dict) else {} for record in records]
+    values = np.zeros((len(records), len(fields)))
+    for j, name in enumerate(fields):
+        column = [record.get(name, 0.0) for record in records]
+        errors += [((error["loc"][2], j), error) for error in _fill(values[:, j], column, lambda i: ("body", "records", i, name))]
+    return values, [error for _, error in sorted(errors, key=lambda item: item[0])]
+
+def _columns(columns) -> tuple:
+    # ({name: float array}, errors) of FinancialDataBatch.columns, unknown names included.
+    if columns is None:
+        return None, [_none(("body", "columns"))]
+    if not isinstance(columns, dict):
+        try:
+            columns = dict(columns)
+        except (TypeError, ValueError):
+            return None, [_error(("body", "columns"), "value is not a valid dict", "type_error.dict")]
+    arrays, errors = {}, []
+    for name, column in columns.items():
+        if name is None:
+            errors.append(_none(("body", "columns", "__key__")))
+            continue
+        if not isinstance(name, str):
+            if not isinstance(name, (int, float)):
+                errors.append(_error(("body", "columns", "__key__"), "str type expected", "type_error.str"))
+                continue
+            name = str(name)
+        if column is None:
+            errors.append(_none(("body", "columns", name)))
+        elif not isinstance(column, list):
+            errors.append(_error(("body", "columns", name), "value is not a valid list", "type_error.list"))
+        else:
+            arrays[name] = np.empty(len(column))
+            errors += _fill(arrays[name], column, lambda i: ("body", "columns", name, i))
+    return arrays, errors
+
+def decode_batch(body: bytes, fields: Sequence[str]) -> np.ndarray:
+    # A FinancialDataBatch JSON body as an (n, len(fields)) matrix, validated like the
+    # model (float coercion, None rejected, missing fields 0, unknown record keys ignored)
+    # without building a model per statement. Raises BatchError with the status and detail
+    # FastAPI answers the same body with for a FinancialDataBatch parameter.
+    payload = _load_json(body) if body else None
+    if payload is None:
+        raise BatchError(422, [_error(("body",), "field required", "value_error.missing")])
+    if not isinstance(payload, dict):
+        try:
+            payload = dict(payload)
+        except (TypeError, ValueError):
+            raise BatchError(422, [_error(("body",), "value is not a valid dict", "type_error.dict")])
+    records, record_errors = _records(payload.get("records", []), fields)
+    columns, column_errors = _columns(payload.get("columns", {}))
+    if record_errors or column_errors:
+        raise BatchError(422, record_errors + column_errors)
+    if len(records) and columns:
+        raise BatchError(422, "Provide either records or columns, not both.")
+    if len(records):
+        return records
+    unknown = set(columns) - set(fields)
+    if unknown:
+        raise BatchError(422, f"Unknown columns: {', '.join(sorted(unknown))}")
+    if len({len(column) for column in columns.values()}) > 1:
+        raise BatchError(422, "All columns must have the same length.")
+    values = np.zeros((len(next(iter(columns.values()), [])), len(fields)))
+    for j, name in enumerate(fields):
+        if name in columns:
+            values[:, j] = columns[name]
+    return values
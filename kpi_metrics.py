@@ -0,0 +1,317 @@
+import cProfile
+import io
+import json
+import logging
+import math
+import os
+import pstats
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from functools import wraps
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+# Bucket upper bounds in seconds: 1 us to ~100 s in steps of 2**0.25 (quantiles are
+# within ~19% of the true value).
+BOUNDS = tuple(1e-6 * 2 ** (i / 4) for i in range(108))
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Histogram:
+    # Latency histogram without a lock on the write path: every thread counts into its own
+    # shard and readers add the shards up.
+    def __init__(self):
+        self._local = threading.local()
+        self._shards: List[list] = []
+        self._lock = threading.Lock()
+
+    def observe(self, seconds: float) -> None:
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            # [bucket counts..., overflow count, sum]
+            shard = self._local.shard = [0] * (len(BOUNDS) + 1) + [0.0]
+            with self._lock:
+                self._shards.append(shard)
+        shard[bisect_left(BOUNDS, seconds)] += 1
+        shard[-1] += seconds
+
+    def snapshot(self) -> Tuple[List[int], float]:
+        with self._lock:
+            shards = list(self._shards)
+        counts = [0] * (len(BOUNDS) + 1)
+        total = 0.0
+        for shard in shards:
+            for i in range(len(counts)):
+                counts[i] += shard[i]
+            total += shard[-1]
+        return counts, total
+
+    def quantiles(self, counts: List[int], qs: Iterable[float] = QUANTILES) -> Dict[float, float]:
+        # Linear interpolation inside the bucket holding the q-th observation, as
+        # Prometheus' histogram_quantile.
+        count = sum(counts)
+        result = {}
+        for q in qs:
+            if not count:
+                result[q] = math.nan
+                continue
+            rank = q * count
+            seen = 0
+            for i, bucket in enumerate(counts):
+                if bucket and seen + bucket >= rank:
+                    lower = BOUNDS[i - 1] if i else 0.0
+                    upper = BOUNDS[i] if i < len(BOUNDS) else BOUNDS[-1]
+                    result[q] = lower + (upper - lower) * (rank - seen) / bucket
+                    break
+                seen += bucket
+        return result
+
+
+class StageMetrics:
+    # Request stage timings keyed by (handler, stage), e.g. ("analyze_financials", "compute").
+    def __init__(self, name: str = "kpi_request_stage_seconds"):
+        self.name = name
+        self._histograms: Dict[Tuple[str, str], Histogram] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, handler: str, stage: str, seconds: float) -> None:
+        histogram = self._histograms.get((handler, stage))
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault((handler, stage), Histogram())
+        histogram.observe(seconds)
+
+    def prometheus(self) -> str:
+        lines = [f"# HELP {self.name} Time spent in each stage of a request, by handler.",
+                 f"# TYPE {self.name} summary"]
+        # observe() can add a key on the event loop while this runs in a worker thread.
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+        for (handler, stage), histogram in histograms:
+            counts, total = histogram.snapshot()
+            labels = f'handler="{handler}",stage="{stage}"'
+            for q, value in histogram.quantiles(counts).items():
+                lines.append(f'{self.name}{{{labels},quantile="{q}"}} {value:.9g}')
+            lines.append(f"{self.name}_sum{{{labels}}} {total:.9g}")
+            lines.append(f"{self.name}_count{{{labels}}} {sum(counts)}")
+        return "\n".join(lines) + "\n"
+
+
+def prometheus_metric(name: str, kind: str, help_text: str, value: float) -> str:
+    return f"# HELP {name} {help_text}\n# TYPE {name} {kind}\n{name} {value}\n"
+
+
+class Profiler:
+    # cProfile for a runtime-adjustable fraction of requests, aggregated into one pstats
+    # report per process.
+    def __init__(self, rate: float = 0.0):
+        self.rate = rate
+        self.profiled = 0
+        self._stats: Optional[pstats.Stats] = None
+        self._lock = threading.Lock()
+
+    def sample(self) -> bool:
+        return self.rate > 0 and random.random() < self.rate
+
+    def add(self, profile: cProfile.Profile, requests: int = 0) -> None:
+        with self._lock:
+            self.profiled += requests
+            if self._stats is None:
+                self._stats = pstats.Stats(profile)
+            else:
+                self._stats.add(profile)
+
+    def report(self, sort: str = "cumulative", limit: int = 40) -> str:
+        with self._lock:
+            if self._stats is None:
+                return "No profiled requests.\n"
+            output = io.StringIO()
+            self._stats.stream = output
+            self._stats.sort_stats(sort).print_stats(limit)
+            return f"{self.profiled} profiled requests\n" + output.getvalue()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._stats = None
+            self.profiled = 0
+
+
+class RequestTiming:
+    __slots__ = ("scope", "middleware", "start", "last", "stages", "fields", "profile")
+
+    def __init__(self, scope: dict, middleware: "TimingMiddleware", profile: Optional[cProfile.Profile]):
+        self.scope = scope
+        self.middleware = middleware
+        self.start = self.last = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.fields: dict = {}
+        self.profile = profile
+
+    @property
+    def handler(self) -> str:
+        endpoint = self.scope.get("endpoint")
+        return getattr(endpoint, "__name__", "unmatched")
+
+
+def request_logger(name: str = "kpi.requests") -> logging.Logger:
+    # JSON lines on stderr unless logging has been configured for `name` already.
+    logger = logging.getLogger(name)
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+    return logger
+
+
+_current: ContextVar[Optional[RequestTiming]] = ContextVar("kpi_request_timing", default=None)
+
+
+class TimingMiddleware:
+    # Pure ASGI middleware timing every HTTP request. Handlers call mark(stage) to close a
+    # stage; the time since the previous mark (or the start of the request) is added to
+    # that stage, whatever follows the last mark to "respond" and the whole request
+    # to "total". A sampled fraction of requests is logged as one JSON line, another is run
+    # under cProfile (one at a time, since the profiler also sees whatever else the event
+    # loop runs meanwhile).
+    def __init__(self, app, metrics: StageMetrics, profiler: Profiler, logger: logging.Logger, log_rate: float = 0.0):
+        self.app = app
+        self.metrics = metrics
+        self.profiler = profiler
+        self.logger = logger
+        self.log_rate = log_rate
+        self._profiling = False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        profile = None
+        if not self._profiling and self.profiler.sample():
+            profile = cProfile.Profile()
+            self._profiling = True
+        timing = RequestTiming(scope, self, profile)
+        token = _current.set(timing)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        if profile is not None:
+            profile.enable()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            if profile is not None:
+                profile.disable()
+                self._profiling = False
+                self.profiler.add(profile, requests=1)
+            if timing.stages:
+                mark("respond")
+            total = time.perf_counter() - timing.start
+            _current.reset(token)
+            # Recorded once the response has gone out, so histogram updates stay off the
+            # request's latency.
+            handler = timing.handler
+            for stage, seconds in timing.stages.items():
+                self.metrics.observe(handler, stage, seconds)
+            self.metrics.observe(handler, "total", total)
+            if self.log_rate and random.random() < self.log_rate:
+                self.logger.info(json.dumps({
+                    "method": scope["method"], "path": scope["path"], "handler": timing.handler, "status": status,
+                    "ms": round(total * 1e3, 3), "stages_ms": {name: round(seconds * 1e3, 3) for name, seconds in timing.stages.items()},
+                    **timing.fields,
+                }))
+
+
+def mark(stage: str) -> None:
+    # Closes `stage` for the current request; a no-op outside an instrumented request.
+    timing = _current.get()
+    if timing is None:
+        return
+    now = time.perf_counter()
+    seconds = now - timing.last
+    timing.last = now
+    timing.stages[stage] = timing.stages.get(stage, 0.0) + seconds
+
+
+def annotate(**fields) -> None:
+    # Extra fields for the current request's log line, if it is sampled.
+    timing = _current.get()
+    if timing is not None:
+        timing.fields.update(fields)
+
+
+def profiled(function: Callable) -> Callable:
+    # For sync handlers: FastAPI runs them in a worker thread, outside the middleware's
+    # profiler, so a profiled request runs the handler under its own one.
+    @wraps(function)
+    def wrapper(*args, **kwargs):
+        timing = _current.get()
+        if timing is None or timing.profile is None:
+            return function(*args, **kwargs)
+        profile = cProfile.Profile()
+        try:
+            return profile.runcall(function, *args, **kwargs)
+        finally:
+            timing.middleware.profiler.add(profile)
+    return wrapper
+
+
+def instrument(app, log_rate: float, profile_rate: float, extra_metrics: Optional[Callable[[], str]] = None,
+               debug_endpoints: bool = False) -> Tuple[StageMetrics, Profiler]:
+    # Adds TimingMiddleware to a FastAPI app together with GET /metrics (Prometheus text)
+    # and, with debug_endpoints, /debug/profile: GET for the aggregated report, PUT ?rate=
+    # to change the sampled fraction at runtime, DELETE to start over. Both are per
+    # process. /debug/profile has no access control, so it is off unless asked for.
+    from fastapi import HTTPException, Query
+    from fastapi.responses import PlainTextResponse
+
+    metrics = StageMetrics()
+    profiler = Profiler(profile_rate)
+    app.add_middleware(TimingMiddleware, metrics=metrics, profiler=profiler, logger=request_logger(), log_rate=log_rate)
+
+    @app.get("/metrics", response_class=PlainTextResponse)
+    def read_metrics():
+        text = metrics.prometheus() + (extra_metrics() if extra_metrics else "")
+        return PlainTextResponse(text, media_type="text/plain; version=0.0.4")
+
+    if not debug_endpoints:
+        return metrics, profiler
+
+    @app.get("/debug/profile", response_class=PlainTextResponse)
+    def read_profile(sort: str = "cumulative", limit: int = Query(40, ge=1)):
+        if sort not in pstats.Stats.sort_arg_dict_default:
+            raise HTTPException(status_code=422, detail=f"Unknown sort key {sort!r}.")
+        return profiler.report(sort, limit)
+
+    @app.put("/debug/profile")
+    def set_profile_rate(rate: float = Query(..., ge=0, le=1)):
+        profiler.rate = rate
+        return {"rate": profiler.rate, "profiled": profiler.profiled}
+
+    @app.delete("/debug/profile")
+    def reset_profile():
+        profiler.reset()
+        return {"rate": profiler.rate, "profiled": profiler.profiled}
+
+    return metrics, profiler
+
+
+def instrument_from_env(app, extra_metrics: Optional[Callable[[], str]] = None) -> Tuple[StageMetrics, Profiler]:
+    # instrument() configured from the environment: KPI_LOG_SAMPLE_RATE of requests logged
+    # as JSON lines, KPI_PROFILE_RATE of them profiled, /debug/profile mounted when
+    # KPI_DEBUG_ENDPOINTS=1.
+    return instrument(
+        app,
+        log_rate=float(os.environ.get("KPI_LOG_SAMPLE_RATE", 0.01)),
+        profile_rate=float(os.environ.get("KPI_PROFILE_RATE", 0)),
+        extra_metrics=extra_metrics,
+        debug_endpoints=os.environ.get("KPI_DEBUG_ENDPOINTS") == "1",
+    )
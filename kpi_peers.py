@@ -0,0 +1,169 @@
+import fcntl
+import os
+import re
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, Mapping, Optional, Sequence, Tuple
+
+import numpy as np
+
+GROUP_NAME = re.compile(r"^[A-Za-z0-9_.-]{1,128}$")
+QUANTILES = {"p10": 0.1, "p25": 0.25, "median": 0.5, "p75": 0.75, "p90": 0.9}
+
+
+class PeerStore:
+    # Peer groups held column-wise: one float64 matrix of shape (len(kpi_names), companies)
+    # per group, with every KPI row sorted independently so ranking is a binary search.
+    # With a directory, each group is saved as <directory>/<group>.npy and memory-mapped
+    # back; the directory can be shared by several processes: changes are made under an
+    # flock from the current file, and a group is remapped when its file has changed.
+    def __init__(self, kpi_names: Sequence[str], directory: Optional[str] = None):
+        self.kpi_names = list(kpi_names)
+        self.directory = directory
+        self._groups: Dict[str, np.ndarray] = {}
+        self._versions: Dict[str, Tuple[int, int]] = {}
+        self._summaries: Dict[str, dict] = {}
+        self._lock = threading.RLock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def groups(self) -> Dict[str, int]:
+        if self.directory:
+            names = {name[:-4] for name in os.listdir(self.directory) if name.endswith(".npy")}
+        else:
+            names = set(self._groups)
+        return {name: self._matrix(name).shape[1] for name in sorted(names)}
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        # Serializes changes between threads and, with a directory, between processes.
+        with self._lock:
+            if not self.directory:
+                yield
+                return
+            with open(os.path.join(self.directory, "lock"), "a") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def add(self, group: str, kpis: np.ndarray) -> int:
+        # kpis has one row per company and one column per KPI name. Merges them into the
+        # sorted rows; companies with a non-finite KPI are skipped.
+        _check_group(group)
+        values = np.asarray(kpis, dtype=float).reshape(-1, len(self.kpi_names)).T
+        values = np.sort(values[:, np.isfinite(values).all(axis=0)], axis=1)
+        with self._locked():
+            current = self._matrix(group)
+            merged = np.empty((len(self.kpi_names), current.shape[1] + values.shape[1]))
+            for i, row in enumerate(current):
+                merged[i] = np.insert(row, np.searchsorted(row, values[i]), values[i])
+            self._groups[group] = merged
+            self._summaries.pop(group, None)
+            if self.directory:
+                path = os.path.join(self.directory, f"{group}.npy")
+                with open(path + ".tmp", "wb") as file:
+                    np.save(file, merged)
+                os.replace(path + ".tmp", path)
+                self._versions[group] = _version(os.stat(path))
+        return values.shape[1]
+
+    def remove(self, group: str) -> None:
+        _check_group(group)
+        with self._locked():
+            self._forget(group)
+            if self.directory and os.path.exists(os.path.join(self.directory, f"{group}.npy")):
+                os.remove(os.path.join(self.directory, f"{group}.npy"))
+
+    def rank(self, group: str, kpis: Mapping[str, float]) -> Dict[str, Optional[float]]:
+        # Percentile of each KPI within the group, counting ties as half below.
+        matrix = self._matrix(group)
+        count = matrix.shape[1]
+        percentiles = {}
+        for name, row in zip(self.kpi_names, matrix):
+            value = kpis[name]
+            if not count or value != value:
+                percentiles[name] = None
+                continue
+            below = row.searchsorted(value, "left")
+            not_above = row.searchsorted(value, "right")
+            percentiles[name] = round(float(below + not_above) / 2 / count * 100, 2)
+        return percentiles
+
+    def summary(self, group: str) -> dict:
+        # _matrix first: it drops the cached summary when the group changed on disk.
+        matrix = self._matrix(group)
+        summary = self._summaries.get(group)
+        if summary is None:
+            count = matrix.shape[1]
+            summary = {"count": count, "kpis": {}}
+            if count:
+                means = matrix.mean(axis=1)
+                for i, name in enumerate(self.kpi_names):
+                    row = matrix[i]
+                    stats = {"mean": float(means[i]), "min": float(row[0]), "max": float(row[-1])}
+                    stats.update({label: _sorted_quantile(row, q) for label, q in QUANTILES.items()})
+                    summary["kpis"][name] = stats
+            self._summaries[group] = summary
+        return summary
+
+    def _matrix(self, group: str) -> np.ndarray:
+        if not self.directory:
+            _check_group(group)
+            return self._groups.get(group, np.empty((len(self.kpi_names), 0)))
+        matrix = self._groups.get(group)
+        path = os.path.join(self.directory, f"{group}.npy")
+        try:
+            version = _version(os.stat(path))
+        except FileNotFoundError:
+            _check_group(group)
+            if matrix is not None:
+                with self._lock:
+                    self._forget(group)
+            return np.empty((len(self.kpi_names), 0))
+        if matrix is None or self._versions.get(group) != version:
+            _check_group(group)
+            with self._lock:
+                version, matrix = _load_mapped(path)
+                if matrix.ndim != 2 or matrix.shape[0] != len(self.kpi_names):
+                    raise ValueError(f"Peer group {group} was stored with a different KPI layout.")
+                self._groups[group] = matrix
+                self._versions[group] = version
+                self._summaries.pop(group, None)
+        return matrix
+
+    def _forget(self, group: str) -> None:
+        self._groups.pop(group, None)
+        self._versions.pop(group, None)
+        self._summaries.pop(group, None)
+
+
+def _version(stat: os.stat_result) -> Tuple[int, int]:
+    return stat.st_ino, stat.st_mtime_ns
+
+
+def _load_mapped(path: str) -> Tuple[Tuple[int, int], np.ndarray]:
+    # Maps the .npy file through one descriptor: np.load(mmap_mode=...) reopens the path,
+    # which another process may have replaced since the header was read.
+    with open(path, "rb") as file:
+        version = _version(os.fstat(file.fileno()))
+        major, _ = np.lib.format.read_magic(file)
+        read_header = np.lib.format.read_array_header_1_0 if major == 1 else np.lib.format.read_array_header_2_0
+        shape, fortran_order, dtype = read_header(file)
+        if not np.prod(shape):
+            return version, np.empty(shape, dtype=dtype)
+        return version, np.memmap(file, dtype=dtype, mode="r", offset=file.tell(), shape=shape, order="F" if fortran_order else "C")
+
+
+def _check_group(group: str) -> None:
+    if not GROUP_NAME.match(group):
+        raise ValueError(f"Invalid peer group name {group!r}: use letters, digits, '_', '.' or '-'.")
+
+
+def _sorted_quantile(row: np.ndarray, q: float) -> float:
+    # Linear interpolation between closest ranks, as numpy.quantile's default method.
+    position = q * (len(row) - 1)
+    lower = int(position)
+    upper = min(lower + 1, len(row) - 1)
+    return float(row[lower] + (row[upper] - row[lower]) * (position - lower))
@@ -0,0 +1,193 @@
+import asyncio
+import contextvars
+import hashlib
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from fastapi import HTTPException, Request
+
+from kpi_metrics import mark, profiled, prometheus_metric
+
+
+class Scheduler:
+    # Admission control and offloading for compute-bound handlers. A request either joins an
+    # identical one already in flight (same key: computed once, every caller gets the
+    # result or the error), or is admitted to a bounded thread pool:
+    # - 429 when its client already has client_limit requests in flight,
+    # - 503 when max_queue requests are already waiting for one of the workers,
+    # both with a Retry-After estimated from the recent service time, so overload is
+    # answered at once instead of growing every request's latency.
+    def __init__(self, workers: int, max_queue: int, client_limit: int, coalesce: bool = True):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.client_limit = client_limit
+        self.coalesce = coalesce
+        self.pending = 0
+        self.completed = 0
+        self.coalesced = 0
+        self.rejected_queue = 0
+        self.rejected_client = 0
+        # Moving average of the time a worker spends on one request.
+        self.service_seconds = 0.0
+        self._clients: Dict[str, int] = {}
+        self._in_flight: Dict[Hashable, asyncio.Future] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "Scheduler":
+        # KPI_WORKERS threads (default: one per CPU), at most KPI_MAX_QUEUE requests waiting
+        # for them, KPI_CLIENT_CONCURRENCY requests in flight per client, identical requests
+        # in flight computed once unless KPI_COALESCE=0.
+        return cls(
+            workers=int(os.environ.get("KPI_WORKERS", os.cpu_count() or 1)),
+            max_queue=int(os.environ.get("KPI_MAX_QUEUE", 64)),
+            client_limit=int(os.environ.get("KPI_CLIENT_CONCURRENCY", 16)),
+            coalesce=os.environ.get("KPI_COALESCE", "1") != "0",
+        )
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="kpi-worker")
+            return self._executor
+
+    @property
+    def queued(self) -> int:
+        return max(0, self.pending - self.workers)
+
+    async def run(self, request: Request, function: Callable, *args, key: Optional[Hashable] = None,
+                  coalesce: bool = True) -> Any:
+        # Result of function(*args) computed in the pool. Without a key, requests coalesce
+        # on their method, path, query string and body. Writes pass coalesce=False: two
+        # identical uploads are two changes.
+        coalesce = self.coalesce and coalesce
+        if coalesce and key is None:
+            key = await request_key(request)
+        client = client_address(request)
+        self._check_client(client)
+
+        future = self._in_flight.get(key) if coalesce else None
+        if future is not None:
+            self.coalesced += 1
+        else:
+            self._check_queue()
+            future = self._submit(function, args)
+            if coalesce:
+                self._in_flight[key] = future
+                future.add_done_callback(lambda _: self._in_flight.pop(key, None))
+
+        self._clients[client] = self._clients.get(client, 0) + 1
+        try:
+            # Shielded: a caller that disconnects must not cancel the work others wait for.
+            return await asyncio.shield(future)
+        finally:
+            self._release(client)
+
+    def admit(self, request: Request) -> Callable[[], None]:
+        # For a response that keeps submitting work after its status has gone out, such as
+        # a streamed body: the 429 or 503 that run() would answer is decided now, once. The
+        # request then holds one of its client's slots until the returned release function
+        # is called, and its work goes through run_admitted(), which waits for a worker
+        # instead of being rejected.
+        client = client_address(request)
+        self._check_client(client)
+        self._check_queue()
+        self._clients[client] = self._clients.get(client, 0) + 1
+        released = False
+
+        def release() -> None:
+            nonlocal released
+            if not released:
+                released = True
+                self._release(client)
+        return release
+
+    async def run_admitted(self, function: Callable, *args) -> Any:
+        return await asyncio.shield(self._submit(function, args))
+
+    def _check_client(self, client: str) -> None:
+        if self._clients.get(client, 0) >= self.client_limit:
+            self.rejected_client += 1
+            raise HTTPException(status_code=429, detail=f"More than {self.client_limit} concurrent requests from this client.",
+                                headers={"Retry-After": str(self.retry_after())})
+
+    def _check_queue(self) -> None:
+        if self.queued >= self.max_queue:
+            self.rejected_queue += 1
+            raise HTTPException(status_code=503, detail="The KPI service is overloaded.",
+                                headers={"Retry-After": str(self.retry_after())})
+
+    def _release(self, client: str) -> None:
+        count = self._clients.pop(client) - 1
+        if count:
+            self._clients[client] = count
+
+    def retry_after(self) -> int:
+        # Seconds until the current backlog has drained, at least 1.
+        return max(1, math.ceil((self.queued + 1) * self.service_seconds / self.workers))
+
+    def _submit(self, function: Callable, args: tuple) -> asyncio.Future:
+        # Runs in a copy of the request's context so that mark() and the profiler still see
+        # the request; the wait for a worker is recorded as the "queue" stage.
+        context = contextvars.copy_context()
+        function = profiled(function)
+
+        def work():
+            mark("queue")
+            start = time.perf_counter()
+            try:
+                return function(*args)
+            finally:
+                elapsed = time.perf_counter() - start
+                self.service_seconds += (elapsed - self.service_seconds) * 0.1
+
+        self.pending += 1
+        future = asyncio.get_running_loop().run_in_executor(self.executor, context.run, work)
+        future.add_done_callback(self._finish)
+        return future
+
+    def _finish(self, future: asyncio.Future) -> None:
+        self.pending -= 1
+        self.completed += 1
+
+    def prometheus(self) -> str:
+        return "".join([
+            prometheus_metric("kpi_scheduler_workers", "gauge", "Worker threads computing KPIs.", self.workers),
+            prometheus_metric("kpi_scheduler_pending", "gauge", "Requests running or waiting for a worker.", self.pending),
+            prometheus_metric("kpi_scheduler_queued", "gauge", "Requests waiting for a worker.", self.queued),
+            prometheus_metric("kpi_scheduler_completed_total", "counter", "Requests computed by the workers.", self.completed),
+            prometheus_metric("kpi_scheduler_coalesced_total", "counter", "Requests answered by an identical request in flight.", self.coalesced),
+            prometheus_metric("kpi_scheduler_rejected_queue_total", "counter", "Requests rejected with 503 because the queue was full.", self.rejected_queue),
+            prometheus_metric("kpi_scheduler_rejected_client_total", "counter", "Requests rejected with 429 for exceeding the per-client limit.", self.rejected_client),
+            prometheus_metric("kpi_scheduler_service_seconds", "gauge", "Moving average of the worker time per request.", round(self.service_seconds, 9)),
+        ])
+
+    def shutdown(self) -> None:
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(cancel_futures=True)
+                self._executor = None
+
+
+async def request_key(request: Request) -> bytes:
+    body = await request.body()
+    digest = hashlib.blake2b(digest_size=16)
+    for part in (request.method.encode(), request.url.path.encode(), request.url.query.encode(), body):
+        digest.update(len(part).to_bytes(8, "little"))
+        digest.update(part)
+    return digest.digest()
+
+
+def client_address(request: Request) -> str:
+    # Behind the Heroku router the socket peer is the router; it appends the address it saw
+    # to X-Forwarded-For, so the last entry is the one a client cannot forge.
+    forwarded = request.headers.get("x-forwarded-for")
+    if forwarded:
+        return forwarded.rsplit(",", 1)[-1].strip()
+    return request.client.host if request.client else ""
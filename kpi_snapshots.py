@@ -0,0 +1,321 @@
+import fcntl
+import hashlib
+import json
+import mmap
+import os
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+
+# One record per stored row in keys.bin.
+KEY_DTYPE = np.dtype([("company", "S64"), ("year", "<i4")])
+MAX_COMPANY_BYTES = KEY_DTYPE["company"].itemsize
+# Years outside this range are rejected rather than wrapped into the int32 key.
+MIN_YEAR, MAX_YEAR = 0, 9999
+
+
+def company_hash(company: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(company, digest_size=8).digest(), "little")
+
+
+class SnapshotStore:
+    # Append-only columnar KPI snapshots in a directory shared by all worker processes:
+    #   kpis.json      KPI names, one column file per name in this order
+    #   <i>.f64        raw little-endian float64 values of KPI i, one per row
+    #   keys.bin       (company, year) of every row, KEY_DTYPE records
+    #   index-<n>.npy  index segments, (3, k) uint64: company hash, year, row; one entry per
+    #                  (company, year) pointing at its latest row in the segment, sorted by
+    #                  hash then year. Immutable once written.
+    #   segments.json  committed row count, distinct (company, year) count and the segment
+    #                  names, oldest first; a newer segment's entry wins over an older one's
+    # Writers append rows and a segment for them under an exclusive flock, then atomically
+    # replace segments.json, which is the commit point: rows past the committed count are
+    # leftovers of an interrupted append and get truncated by the next writer. A new
+    # segment is merged with the one before it while that one is at most twice its size,
+    # so each segment is more than twice the next newer one (at most log2(keys) of them)
+    # and a small append only re-sorts the small newest segments, not the whole index.
+    # Readers load new segments and memory-map the other files read-only whenever
+    # segments.json changes, so every process shares the column pages and lookups never
+    # copy a column.
+    def __init__(self, directory: str, kpi_names: Sequence[str]):
+        self.directory = directory
+        self.kpi_names = list(kpi_names)
+        os.makedirs(directory, exist_ok=True)
+        names_path = os.path.join(directory, "kpis.json")
+        with self._locked():
+            if os.path.exists(names_path):
+                with open(names_path) as file:
+                    if json.load(file) != self.kpi_names:
+                        raise ValueError(f"Snapshot store {directory} was written with a different KPI layout.")
+            else:
+                with open(names_path + ".tmp", "w") as file:
+                    json.dump(self.kpi_names, file)
+                os.replace(names_path + ".tmp", names_path)
+        self._mapped: Optional[Tuple[Tuple[int, int], int, List[np.ndarray], np.ndarray, List[np.ndarray]]] = None
+        # Loaded segments by file name; they never change once written.
+        self._segments: Dict[str, np.ndarray] = {}
+        self._lock = threading.Lock()
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.directory, name)
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        with open(self._path("lock"), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _load(self) -> Tuple[Tuple[int, int], dict, List[np.ndarray]]:
+        # (version, manifest, segments) as of the latest segments.json. A writer may delete
+        # merged segments between reading the manifest and opening them: read it again.
+        while True:
+            try:
+                file = open(self._path("segments.json"), "rb")
+            except FileNotFoundError:
+                return (0, 0), {"rows": 0, "keys": 0, "segments": []}, []
+            with file:
+                stat = os.fstat(file.fileno())
+                manifest = json.load(file)
+            try:
+                segments = [self._segment(name) for name in manifest["segments"]]
+            except FileNotFoundError:
+                continue
+            for name in set(self._segments) - set(manifest["segments"]):
+                del self._segments[name]
+            return (stat.st_ino, stat.st_mtime_ns), manifest, segments
+
+    def _segment(self, name: str) -> np.ndarray:
+        segment = self._segments.get(name)
+        if segment is None:
+            segment = self._segments[name] = np.load(self._path(name))
+        return segment
+
+    def _snapshot(self) -> Tuple[List[np.ndarray], np.ndarray, List[np.ndarray]]:
+        # (segments, keys, columns) as of the latest committed segments.json.
+        try:
+            stat = os.stat(self._path("segments.json"))
+        except FileNotFoundError:
+            return [], np.empty(0, dtype=KEY_DTYPE), [np.empty(0)] * len(self.kpi_names)
+        mapped = self._mapped
+        if mapped is None or mapped[0] != (stat.st_ino, stat.st_mtime_ns):
+            with self._lock:
+                mapped = self._mapped
+                if mapped is None or mapped[0] != (stat.st_ino, stat.st_mtime_ns):
+                    version, manifest, segments = self._load()
+                    rows = manifest["rows"]
+                    keys = _map(self._path("keys.bin"), KEY_DTYPE, rows)
+                    columns = [_map(self._path(f"{i}.f64"), np.dtype("<f8"), rows) for i in range(len(self.kpi_names))]
+                    mapped = self._mapped = (version, manifest["keys"], segments, keys, columns)
+        return mapped[2], mapped[3], mapped[4]
+
+    def current(self) -> bool:
+        # Whether lookups can use the mapped snapshot as it is, without loading anything.
+        mapped = self._mapped
+        try:
+            stat = os.stat(self._path("segments.json"))
+        except FileNotFoundError:
+            return True
+        return mapped is not None and mapped[0] == (stat.st_ino, stat.st_mtime_ns)
+
+    def append(self, companies: Sequence[str], years: Sequence[int], kpis: np.ndarray) -> int:
+        # Stores one row per (company, year) with its KPI values (shape (n, len(kpi_names)));
+        # a later row for the same company and year replaces the earlier one in the index.
+        keys = np.empty(len(companies), dtype=KEY_DTYPE)
+        keys["company"] = [_company_bytes(company) for company in companies]
+        for year in years:
+            if not MIN_YEAR <= year <= MAX_YEAR:
+                raise ValueError(f"Year {year} is outside {MIN_YEAR}..{MAX_YEAR}.")
+        keys["year"] = years
+        kpis = np.asarray(kpis, dtype="<f8").reshape(len(keys), len(self.kpi_names))
+        if not len(keys):
+            return 0
+        with self._locked():
+            with self._lock:
+                _, manifest, segments = self._load()
+            committed = manifest["rows"]
+            _append(self._path("keys.bin"), committed * KEY_DTYPE.itemsize, keys.tobytes())
+            for i in range(len(self.kpi_names)):
+                _append(self._path(f"{i}.f64"), committed * 8, np.ascontiguousarray(kpis[:, i]).tobytes())
+
+            rows = np.arange(committed, committed + len(keys), dtype=np.uint64)
+            hashes = np.array([company_hash(company) for company in keys["company"]], dtype=np.uint64)
+            new = _merge([np.vstack([hashes, keys["year"].astype(np.uint64), rows])])
+            known = np.zeros(new.shape[1], dtype=bool)
+            for segment in segments:
+                known |= _find(segment, new[0], new[1]) >= 0
+            names = list(manifest["segments"])
+            while segments and segments[-1].shape[1] <= 2 * new.shape[1]:
+                names.pop()
+                new = _merge([segments.pop(), new])
+            name = f"index-{committed + len(keys):012d}.npy"
+            with open(self._path(name + ".tmp"), "wb") as file:
+                np.save(file, new)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(self._path(name + ".tmp"), self._path(name))
+            with self._lock:
+                self._segments[name] = new
+            manifest = {"rows": committed + len(keys), "keys": manifest["keys"] + int((~known).sum()), "segments": names + [name]}
+            with open(self._path("segments.json.tmp"), "w") as file:
+                json.dump(manifest, file)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(self._path("segments.json.tmp"), self._path("segments.json"))
+            # Merged segments, and any an interrupted append left behind.
+            for stale in os.listdir(self.directory):
+                if stale.startswith("index-") and stale not in manifest["segments"]:
+                    os.remove(self._path(stale))
+        return len(keys)
+
+    def get(self, company: str, year: int) -> Optional[Dict[str, float]]:
+        segments, keys, columns = self._snapshot()
+        name = _company_bytes(company)
+        key = company_hash(name)
+        year &= 0xFFFFFFFFFFFFFFFF
+        # Newest segment first. One company has a handful of years: walk them instead of
+        # masking the whole range.
+        for index in reversed(segments):
+            hashes = index[0]
+            position = int(hashes.searchsorted(np.uint64(key)))
+            while position < len(hashes) and hashes.item(position) == key:
+                row = index.item(2, position)
+                if index.item(1, position) == year and keys.item(row)[0] == name:
+                    return dict(zip(self.kpi_names, [column.item(row) for column in columns]))
+                position += 1
+        return None
+
+    def scan(self, company: str, start_year: Optional[int] = None, end_year: Optional[int] = None) -> Dict[str, list]:
+        # Every stored year of a company within [start_year, end_year], oldest first, as
+        # columns: {"year": [...], <kpi>: [...]}.
+        segments, keys, columns = self._snapshot()
+        name = _company_bytes(company)
+        latest = {}
+        for index in reversed(segments):
+            for row in _rows(index, keys, name, start_year, end_year).tolist():
+                latest.setdefault(keys.item(row)[1], row)
+        rows = np.array([latest[year] for year in sorted(latest)], dtype=np.intp)
+        result = {"year": keys["year"][rows].tolist()}
+        for name, column in zip(self.kpi_names, columns):
+            result[name] = column[rows].tolist()
+        return result
+
+    def count(self) -> int:
+        # Distinct (company, year) keys, kept in segments.json.
+        self._snapshot()
+        return self._mapped[1] if self._mapped is not None else 0
+
+
+class LazySnapshotStore:
+    # The SnapshotStore of one app, <root>/<name> with root KPI_SNAPSHOT_DIR by default,
+    # opened on first call (opening takes the flock, and the KPI names may come from running
+    # the app's own calculation), and the lookups behind its GET routes. A lookup on a
+    # current snapshot only reads mapped pages, a few microseconds, so it runs on the event
+    # loop rather than paying for a worker thread; opening the store or loading another
+    # process's new index segments runs in one. An append landing between the check and the
+    # lookup is still picked up on the loop, which is rare and loads the new segment only.
+    def __init__(self, name: str, kpi_names: Callable[[], Sequence[str]], root: Optional[str] = None):
+        self.directory = os.path.join(root or os.environ.get("KPI_SNAPSHOT_DIR", "kpi_snapshots"), name)
+        self.kpi_names = kpi_names
+        self._store: Optional[SnapshotStore] = None
+        self._lock = threading.Lock()
+
+    def __call__(self) -> SnapshotStore:
+        if self._store is None:
+            with self._lock:
+                if self._store is None:
+                    self._store = SnapshotStore(self.directory, self.kpi_names())
+        return self._store
+
+    async def get(self, company: str, year: int) -> Dict[str, float]:
+        # The stored KPIs of a company-year; 404 when there are none, 422 for invalid keys.
+        kpis = await self._read(lambda store: store.get(company, year))
+        if kpis is None:
+            raise HTTPException(status_code=404, detail=f"No KPIs stored for {company} {year}.")
+        return kpis
+
+    async def scan(self, company: str, start_year: Optional[int] = None, end_year: Optional[int] = None) -> Dict[str, list]:
+        return await self._read(lambda store: store.scan(company, start_year, end_year))
+
+    async def _read(self, lookup: Callable[[SnapshotStore], object]):
+        store = self._store
+        try:
+            if store is not None and store.current():
+                return lookup(store)
+            return await run_in_threadpool(lambda: lookup(self()))
+        except ValueError as e:
+            raise HTTPException(status_code=422, detail=str(e))
+
+
+def _merge(segments: List[np.ndarray]) -> np.ndarray:
+    # One segment from several, oldest first: sorted by hash then year, the latest row
+    # winning per (hash, year).
+    merged = np.hstack(segments)
+    # Sort by row descending first, keep the first.
+    order = np.lexsort((-merged[2].astype(np.int64), merged[1], merged[0]))
+    merged = merged[:, order]
+    first = np.ones(merged.shape[1], dtype=bool)
+    first[1:] = (merged[0, 1:] != merged[0, :-1]) | (merged[1, 1:] != merged[1, :-1])
+    return np.ascontiguousarray(merged[:, first])
+
+
+def _find(index: np.ndarray, hashes: np.ndarray, years: np.ndarray) -> np.ndarray:
+    # Position of each (hash, year) in a segment, -1 where it has none. Entries of one hash
+    # are a company's few years, stepped through together for all keys.
+    lo = index[0].searchsorted(hashes, "left")
+    hi = index[0].searchsorted(hashes, "right")
+    found = np.full(len(hashes), -1, dtype=np.int64)
+    for step in range(int((hi - lo).max(initial=0))):
+        position = lo + step
+        match = (position < hi) & (found < 0)
+        match[match] = index[1, position[match]] == years[match]
+        found[match] = position[match]
+    return found
+
+
+def _rows(index: np.ndarray, keys: np.ndarray, name: bytes, start_year: Optional[int], end_year: Optional[int]) -> np.ndarray:
+    hashes = index[0]
+    key = np.uint64(company_hash(name))
+    lo, hi = hashes.searchsorted(key, "left"), hashes.searchsorted(key, "right")
+    years = index[1, lo:hi].astype(np.int64)
+    rows = index[2, lo:hi]
+    selected = np.ones(len(rows), dtype=bool)
+    if start_year is not None:
+        selected &= years >= start_year
+    if end_year is not None:
+        selected &= years <= end_year
+    rows = rows[selected].astype(np.intp)
+    # Hash collisions: keep the rows that really belong to this company.
+    return rows[keys["company"][rows] == name]
+
+
+def _company_bytes(company: str) -> bytes:
+    encoded = company.encode()
+    if not encoded or len(encoded) > MAX_COMPANY_BYTES or b"\0" in encoded:
+        raise ValueError(f"Company names must be 1 to {MAX_COMPANY_BYTES} bytes of UTF-8 without NUL characters.")
+    return encoded
+
+
+def _append(path: str, size: int, data: bytes) -> None:
+    # Appends after the first `size` bytes, dropping anything an interrupted writer left.
+    with open(path, "ab") as file:
+        file.truncate(size)
+        file.write(data)
+        file.flush()
+        os.fsync(file.fileno())
+
+
+def _map(path: str, dtype: np.dtype, rows: int) -> np.ndarray:
+    # A plain read-only ndarray over the mapping: indexing np.memmap scalars costs several
+    # times more.
+    if not rows:
+        return np.empty(0, dtype=dtype)
+    with open(path, "rb") as file:
+        mapping = mmap.mmap(file.fileno(), rows * dtype.itemsize, access=mmap.ACCESS_READ)
+    return np.frombuffer(mapping, dtype=dtype, count=rows)
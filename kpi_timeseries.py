@@ -0,0 +1,197 @@
+import threading
+from typing import Callable, Dict, Iterable, List, Tuple
+
+import numpy as np
+import pandas as pd
+
+INDEX = ["company", "year"]
+
+
+class TimeSeriesPanel:
+    # Multi-year KPI panel keyed by (company, year). Per-year KPIs come from kpi_function,
+    # which maps a frame of raw inputs to a frame of KPI columns on the same index. On top of
+    # those the panel derives period-over-period KPI deltas, growth rates, returns on averaged
+    # balances and per-company summaries (average, OLS trend slope per year, CAGR).
+    # Histories are stored per company as NumPy blocks so appending a year only touches the
+    # companies it belongs to. Methods that read or change the stored state hold a lock,
+    # since a shared panel is used from concurrent request threads.
+    def __init__(self, kpi_function: Callable[[pd.DataFrame], pd.DataFrame], growth_columns: Iterable[str],
+                 average_balances: Dict[str, Tuple[str, str]]):
+        self.kpi_function = kpi_function
+        self.growth_columns = list(growth_columns)
+        self.average_balances = dict(average_balances)
+        self.base_columns: List[str] = []
+        self.kpi_columns: List[str] = []
+        self._histories: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+        self._summaries: Dict[str, np.ndarray] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def columns(self) -> List[str]:
+        return (self.base_columns + [f"{column} Delta" for column in self.kpi_columns]
+                + [f"{column} Growth" for column in self.growth_columns] + list(self.average_balances))
+
+    @property
+    def summary_columns(self) -> List[str]:
+        return (["Years"] + [f"{column} Average" for column in self.base_columns]
+                + [f"{column} Trend" for column in self.base_columns] + [f"{column} CAGR" for column in self.growth_columns])
+
+    def __contains__(self, company: str) -> bool:
+        return company in self._histories
+
+    def compute(self, inputs: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        # Full vectorized pass over a whole panel, without touching the stored state.
+        with self._lock:
+            companies, years, base = self._base(inputs)
+            starts = _group_starts(companies)
+            full, summary = self._derive_all(years, base, starts)
+            return self._frame(companies, years, full), self._summary_frame(companies[starts], summary)
+
+    def load(self, inputs: pd.DataFrame) -> None:
+        with self._lock:
+            companies, years, base = self._base(inputs)
+            starts = _group_starts(companies)
+            full, summary = self._derive_all(years, base, starts)
+            self._histories.clear()
+            self._summaries.clear()
+            self._store(companies[starts], starts, years, full, summary)
+
+    def append(self, inputs: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        # Adds or replaces company-years. Only the new rows get per-year KPIs; deltas are
+        # recomputed for the new rows and the rows directly following them, and summaries
+        # for the touched companies. Returns the recomputed rows and summaries.
+        with self._lock:
+            companies, years, base = self._base(inputs)
+            new_starts = _group_starts(companies)
+            touched = companies[new_starts]
+            group = np.repeat(np.arange(len(touched)), np.diff(np.append(new_starts, len(companies))))
+            new_full = np.full((len(years), len(self.columns)), np.nan)
+            new_full[:, :base.shape[1]] = base
+
+            stored = [(i, self._histories[company]) for i, company in enumerate(touched) if company in self._histories]
+            if stored:
+                old_group = np.concatenate([np.full(len(block_years), i) for i, (block_years, _) in stored])
+                old_years = np.concatenate([block_years for _, (block_years, _) in stored])
+                old_full = np.concatenate([block for _, (_, block) in stored])
+                keep = ~np.isin(_row_keys(old_group, old_years), _row_keys(group, years))
+                group = np.concatenate([old_group[keep], group])
+                years = np.concatenate([old_years[keep], years])
+                full = np.concatenate([old_full[keep], new_full])
+                is_new = np.concatenate([np.zeros(keep.sum(), dtype=bool), np.ones(len(new_full), dtype=bool)])
+            else:
+                full, is_new = new_full, np.ones(len(new_full), dtype=bool)
+
+            order = np.lexsort((years, group))
+            group, years, full, is_new = group[order], years[order], full[order], is_new[order]
+            starts = _group_starts(group)
+            affected = is_new.copy()
+            affected[1:] |= is_new[:-1] & (group[1:] == group[:-1])
+
+            rows = np.flatnonzero(affected)
+            base_width = len(self.base_columns)
+            full[rows, base_width:] = self._derive(full[:, :base_width], starts, rows)
+            summary = self._summarize(years, full[:, :base_width], starts)
+            self._store(touched, starts, years, full, summary)
+
+            companies = touched[group]
+            return self._frame(companies[rows], years[rows], full[rows]), self._summary_frame(touched, summary)
+
+    def history(self, company: str) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        with self._lock:
+            years, full = self._histories[company]
+            companies = np.full(len(years), company, dtype=object)
+            return self._frame(companies, years, full), self._summary_frame(companies[:1], self._summaries[company][None, :])
+
+    def _base(self, inputs: pd.DataFrame) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        inputs = inputs.set_index(INDEX) if not isinstance(inputs.index, pd.MultiIndex) else inputs
+        inputs = inputs[~inputs.index.duplicated(keep="last")].astype(float).fillna(0).sort_index()
+        kpis = self.kpi_function(inputs)
+        self.base_columns = list(inputs.columns) + list(kpis.columns)
+        self.kpi_columns = list(kpis.columns)
+        companies = inputs.index.get_level_values("company").to_numpy(dtype=object)
+        years = inputs.index.get_level_values("year").to_numpy(dtype=np.int64)
+        return companies, years, np.hstack([inputs.to_numpy(), kpis.to_numpy(dtype=float)])
+
+    def _derive_all(self, years: np.ndarray, base: np.ndarray, starts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        derived = self._derive(base, starts, np.arange(len(base)))
+        return np.hstack([base, derived]), self._summarize(years, base, starts)
+
+    def _derive(self, base: np.ndarray, starts: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        # base is sorted by (company, year); only the given rows are derived.
+        first_of_company = np.zeros(len(base), dtype=bool)
+        first_of_company[starts] = True
+        current = base[rows]
+        previous = base[np.maximum(rows - 1, 0)]
+        previous[first_of_company[rows]] = np.nan
+        column = {name: i for i, name in enumerate(self.base_columns)}
+
+        kpi_indices = [column[name] for name in self.kpi_columns]
+        derived = [current[:, kpi_indices] - previous[:, kpi_indices]]
+        for name in self.growth_columns:
+            now, prior = current[:, column[name]], previous[:, column[name]]
+            derived.append(_divide(now - prior, np.abs(prior))[:, None])
+        for flow, balance in self.average_balances.values():
+            average = (current[:, column[balance]] + previous[:, column[balance]]) / 2
+            derived.append(_divide(current[:, column[flow]], average)[:, None])
+        return np.hstack(derived)
+
+    def _summarize(self, years: np.ndarray, base: np.ndarray, starts: np.ndarray) -> np.ndarray:
+        if not len(starts):
+            return np.empty((0, len(self.summary_columns)))
+        ends = np.append(starts[1:], len(base))
+        count = (ends - starts).astype(float)
+        # OLS slope of every column against the year, from per-company sums of the year
+        # offset from the company's first year.
+        x = (years - np.repeat(years[starts], ends - starts)).astype(float)
+        sum_x = np.add.reduceat(x, starts)[:, None]
+        sum_xx = np.add.reduceat(x * x, starts)[:, None]
+        sum_y = np.add.reduceat(base, starts, axis=0)
+        sum_xy = np.add.reduceat(base * x[:, None], starts, axis=0)
+        slope = _divide(count[:, None] * sum_xy - sum_x * sum_y, count[:, None] * sum_xx - sum_x ** 2)
+
+        column = {name: i for i, name in enumerate(self.base_columns)}
+        growth = [column[name] for name in self.growth_columns]
+        span = (years[ends - 1] - years[starts]).astype(float)
+        first, last = base[starts][:, growth], base[ends - 1][:, growth]
+        valid = (first > 0) & (last > 0) & (span[:, None] > 0)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            cagr = np.where(valid, (last / first) ** (1 / np.where(span > 0, span, 1)[:, None]) - 1, np.nan)
+        return np.hstack([count[:, None], sum_y / count[:, None], slope, cagr])
+
+    def _store(self, companies: np.ndarray, starts: np.ndarray, years: np.ndarray, full: np.ndarray, summary: np.ndarray) -> None:
+        ends = np.append(starts[1:], len(years))
+        for company, start, end, row in zip(companies, starts, ends, summary):
+            self._histories[company] = (years[start:end], full[start:end])
+            self._summaries[company] = row
+
+    def _frame(self, companies: np.ndarray, years: np.ndarray, full: np.ndarray) -> pd.DataFrame:
+        index = pd.MultiIndex.from_arrays([companies, years], names=INDEX)
+        return pd.DataFrame(full, index=index, columns=self.columns)
+
+    def _summary_frame(self, companies: np.ndarray, summary: np.ndarray) -> pd.DataFrame:
+        return pd.DataFrame(summary, index=pd.Index(companies, name="company"), columns=self.summary_columns)
+
+
+def _group_starts(groups: np.ndarray) -> np.ndarray:
+    if not len(groups):
+        return np.empty(0, dtype=np.int64)
+    return np.flatnonzero(np.append(True, groups[1:] != groups[:-1]))
+
+
+def _row_keys(group: np.ndarray, years: np.ndarray) -> np.ndarray:
+    return (group.astype(np.int64) << 32) | (years.astype(np.int64) & 0xFFFFFFFF)
+
+
+def _divide(numerator: np.ndarray, denominator: np.ndarray) -> np.ndarray:
+    # NaN where the denominator is zero or missing (first year, single-year history).
+    valid = (denominator != 0) & ~np.isnan(denominator)
+    return np.divide(numerator, denominator, out=np.full(np.broadcast(numerator, denominator).shape, np.nan), where=valid)
+
+
+def frame_to_columns(frame: pd.DataFrame) -> Dict[str, list]:
+    # Columnar JSON-ready dict; NaN (no previous year, undefined CAGR) becomes null.
+    columns = {name: frame.index.get_level_values(name).tolist() for name in frame.index.names}
+    for name in frame.columns:
+        values = frame[name].to_numpy()
+        columns[name] = [None if value != value else value for value in values.tolist()]
+    return columns
@@ -0,0 +1,61 @@
+import asyncio
+import os
+import random
+import sys
+import tempfile
+from typing import Optional
+
+# The apps read their settings at import: keep request logs quiet and snapshots out of
+# the working tree.
+os.environ.setdefault("KPI_LOG_SAMPLE_RATE", "0")
+os.environ.setdefault("KPI_SNAPSHOT_DIR", tempfile.mkdtemp(prefix="kpi-test-snapshots-"))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def request(app, method: str, path: str, body: bytes = b"", content_type: Optional[str] = "application/json",
+            client: str = "127.0.0.1") -> tuple:
+    # One request through the ASGI app in-process: (status, response body).
+    return asyncio.run(request_async(app, method, path, body, content_type, client))
+
+
+async def request_async(app, method: str, path: str, body: bytes = b"", content_type: Optional[str] = "application/json",
+                        client: str = "127.0.0.1") -> tuple:
+    path, _, query = path.partition("?")
+    headers = [(b"content-length", str(len(body)).encode())]
+    if content_type is not None:
+        headers.append((b"content-type", content_type.encode()))
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": method, "scheme": "http",
+        "path": path, "raw_path": path.encode(), "query_string": query.encode(), "root_path": "",
+        "headers": headers, "client": (client, 0), "server": ("127.0.0.1", 80),
+    }
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    response = {"status": None, "body": []}
+
+    async def receive():
+        return messages.pop() if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+        elif message["type"] == "http.response.body":
+            response["body"].append(message.get("body", b""))
+
+    await app(scope, receive, send)
+    return response["status"], b"".join(response["body"])
+
+
+def random_field_value(rng: random.Random):
+    # A statement field value of the kinds clients send, mostly valid and sometimes not.
+    kind = rng.random()
+    if kind < 0.4:
+        return rng.uniform(-1e6, 1e6)
+    if kind < 0.6:
+        return rng.randint(-10**6, 10**6)
+    if kind < 0.7:
+        return rng.choice([0, 0.0, -0.0, 1e-300, 123456789.125])
+    if kind < 0.8:
+        return rng.choice(["12.5", " 7 ", "1e3", "-0", "0x10", "", "abc"])
+    if kind < 0.9:
+        return rng.choice([True, False, None])
+    return rng.choice([[1], {"a": 1}, [], 10**400])
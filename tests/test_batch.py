@@ -0,0 +1,107 @@
+import json
+import random
+
+import numpy as np
+import orjson
+import pydantic
+import pytest
+from fastapi import FastAPI, Response
+
+from conftest import random_field_value, request
+from fin_analyst_api import FIELDS, FinancialDataBatch, app, batch_matrix, calculate_kpi_matrix
+from kpi_kernel import BatchError, decode_batch
+
+# The same body bound to a FinancialDataBatch parameter, as /analyze/batch took it before
+# kpi_kernel.decode_batch.
+reference = FastAPI()
+
+
+@reference.post("/batch")
+def reference_batch(batch: FinancialDataBatch):
+    return Response(orjson.dumps({"kpis": calculate_kpi_matrix(batch_matrix(batch))}, option=orjson.OPT_SERIALIZE_NUMPY))
+
+
+INVALID = [
+    b"", b"null", b"{", b"5", b"\xff\xfe\x00", b'"\\ud800"',
+    b'{"records": null}', b'{"records": 5}', b'{"records": {}}', b'{"records": "ab"}',
+    b'{"records": [null, 5, "ab", [["equity", 2]], {"equity": "x", "cogs": null}, {"cogs": "y"}]}',
+    b'{"records": [{"equity": "1_0", "cogs": "0x10", "sales_revenue": [1]}, {"equity": "x"}], "columns": {"b": ["y", [2]], "a": null}}',
+    b'{"columns": null}', b'{"columns": 5}', b'{"columns": [["equity", [1, "x"]]]}', b'{"columns": [[null, [2]]]}',
+    b'{"columns": {"zzz": [1, null], "equity": null, "cogs": 5}}', b'{"columns": {"zzz": [1]}}',
+    b'{"columns": {"equity": [1], "cogs": [1, 2]}}',
+    b'{"records": [{"equity": 1}], "columns": {"equity": [1]}}',
+    b'{"records": [{"equity": "x"}], "columns": {"equity": ["y"]}}',
+]
+
+VALID = [
+    b"[]", b"{}", b'{"records": []}', b'{"columns": {"equity": ["1e3", true, " 7 "]}}', b'{"records": [{"equity": 1e400}]}',
+    b'{"records": [[["equity", "3"]], {"equity": " 4 ", "unknown": "x"}], "columns": {}}',
+    '{"records": [{"equity": 1}]}'.encode("utf-16"),
+]
+
+
+@pytest.mark.parametrize("body", INVALID)
+def test_batch_errors_match_model(body):
+    expected = request(reference, "POST", "/batch", body)
+    assert expected[0] in (400, 422)
+    assert request(app, "POST", "/analyze/batch", body) == expected
+
+
+@pytest.mark.parametrize("body", VALID)
+def test_batch_values_match_model(body):
+    status, expected = request(reference, "POST", "/batch", body)
+    assert status == 200
+    status, response = request(app, "POST", "/analyze/batch", body)
+    assert status == 200
+    kpis = json.loads(response)["kpis"]
+    assert [list(row) for row in zip(*kpis.values())] == json.loads(expected)["kpis"]
+
+
+@pytest.mark.parametrize("content_type", ["text/plain", None])
+def test_batch_content_type_matches_model(content_type):
+    body = json.dumps({"columns": {"equity": [1.0]}}).encode()
+    expected = request(reference, "POST", "/batch", body, content_type=content_type)
+    status, response = request(app, "POST", "/analyze/batch", body, content_type=content_type)
+    assert status == expected[0]
+    if status != 200:
+        assert response == expected[1]
+
+
+def test_batch_random_statements():
+    statements = np.random.default_rng(1).normal(0, 1e6, (200, len(FIELDS)))
+    body = json.dumps({"records": [dict(zip(FIELDS, row)) for row in statements.tolist()]}).encode()
+    status, response = request(app, "POST", "/analyze/batch", body)
+    assert status == 200
+    kpis = json.loads(response)["kpis"]
+    assert [list(row) for row in zip(*kpis.values())] == json.loads(request(reference, "POST", "/batch", body)[1])["kpis"]
+
+
+@pytest.mark.parametrize("layout", ["records", "columns"])
+def test_decode_batch_matches_model(layout):
+    # Random statements, many with an invalid value: the same matrix as the model, or the
+    # same errors under "body".
+    rng = random.Random(2)
+    for _ in range(200):
+        records = [{name: random_field_value(rng) for name in FIELDS if rng.random() < 0.5} for _ in range(3)]
+        for record in records:
+            for name, value in record.items():
+                if rng.random() < 0.9 and not isinstance(value, float):
+                    record[name] = float(rng.randint(-100, 100))
+        if layout == "records":
+            payload = {"records": records}
+        else:
+            payload = {"columns": {name: [record.get(name, 0.0) for record in records] for name in FIELDS}}
+        body = json.dumps(payload).encode()
+        try:
+            expected = batch_matrix(FinancialDataBatch(**payload))
+        except OverflowError:
+            # 10**400: neither converts it to a float (a 500 on both routes).
+            with pytest.raises(OverflowError):
+                decode_batch(body, FIELDS)
+        except pydantic.ValidationError as e:
+            with pytest.raises(BatchError) as raised:
+                decode_batch(body, FIELDS)
+            assert raised.value.status_code == 422
+            assert raised.value.detail == [{**error, "loc": ("body",) + error["loc"]} for error in e.errors()]
+        else:
+            np.testing.assert_array_equal(decode_batch(body, FIELDS), expected)
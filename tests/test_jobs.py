@@ -0,0 +1,73 @@
+import json
+import os
+import time
+
+import numpy as np
+import pytest
+
+from fin_analyst_api import FIELDS
+from kpi_jobs import JobManager
+from kpi_kernel import BatchError, calculate_kpi_matrix, decode_batch
+
+
+@pytest.fixture(scope="module")
+def manager(tmp_path_factory):
+    manager = JobManager(calculate_kpi_matrix, workers=2, shard_size=30, max_jobs=3, niceness=0,
+                         directory=str(tmp_path_factory.mktemp("jobs")))
+    yield manager
+    manager.shutdown()
+
+
+def job_result(job) -> np.ndarray:
+    results = sorted(job.results, key=lambda result: result[0])
+    assert [start for _, start, _ in results] == list(range(0, job.rows, 30))
+    return np.vstack([kpis for _, _, kpis in results])
+
+
+def test_submit_and_get(manager):
+    values = np.random.default_rng(0).uniform(0, 1e6, (100, len(FIELDS)))
+    job = manager.submit(values)
+    assert (job.rows, job.shards) == (100, 4)
+    assert manager.wait(job, timeout=60)
+    assert manager.get(job.id) is job
+    assert job.status == "done" and job.errors == []
+    np.testing.assert_array_equal(job_result(job), calculate_kpi_matrix(values))
+
+
+def test_spooled_upload(manager):
+    values = np.random.default_rng(1).uniform(0, 1e6, (45, len(FIELDS)))
+    body = json.dumps({"columns": dict(zip(FIELDS, values.T.tolist()))}).encode()
+    path, rows = manager.spool(decode_batch, body, FIELDS).result(timeout=60)
+    assert rows == 45 and os.path.exists(path)
+    job = manager.submit_spooled(path, rows)
+    assert manager.wait(job, timeout=60)
+    np.testing.assert_array_equal(job_result(job), calculate_kpi_matrix(values))
+    # The spooled file goes with the finished job.
+    assert not os.path.exists(path)
+    with pytest.raises(BatchError) as raised:
+        manager.spool(decode_batch, b'{"records": null}', FIELDS).result(timeout=60)
+    assert raised.value.status_code == 422
+
+
+def test_delete_and_expire(manager):
+    job = manager.submit(np.zeros((10, len(FIELDS))))
+    assert manager.delete(job.id)
+    assert manager.get(job.id) is None
+    assert not manager.delete(job.id)
+    # Finished jobs beyond max_jobs are forgotten oldest first.
+    jobs = [manager.submit(np.zeros((1, len(FIELDS)))) for _ in range(4)]
+    for job in jobs:
+        manager.wait(job, timeout=60)
+    assert manager.get(jobs[0].id) is None
+    assert manager.get(jobs[-1].id) is jobs[-1]
+
+
+def test_ttl():
+    manager = JobManager(calculate_kpi_matrix, workers=1, ttl=0.01)
+    try:
+        job = manager.submit(np.zeros((0, len(FIELDS))))
+        assert job.status == "done"
+        time.sleep(0.02)
+        assert manager.get(job.id) is None
+    finally:
+        manager.shutdown()
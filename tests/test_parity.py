@@ -0,0 +1,51 @@
+import json
+import random
+
+import pytest
+
+from conftest import random_field_value, request
+from fin_analyst_api import FIELDS, app, kpi_cache
+
+# /analyze/fast re-implements FastAPI's body decoding and FinancialData's validation
+# (parse_financial_values, _json_payload), so it is compared against /analyze on random and
+# malformed bodies. NaN/Infinity inputs are left out: /analyze fails on the non-finite KPIs
+# they give, /analyze/fast returns them as null.
+
+MALFORMED = [b"", b" ", b"{", b'{"equity": 1,}', b"\xff\xfe", b"[]", b'[["equity", 2]]', b'[["equity"]]', b"5",
+             b'"text"', b"null", b"true", b'{"equity": 1}{', '{"equity": "é"}'.encode()]
+CONTENT_TYPES = [None, "text/plain", "application/vnd.kpi+json", "application/json; charset=utf-8", "APPLICATION/JSON"]
+
+
+def response(path: str, body: bytes, content_type) -> tuple:
+    # (status, decoded JSON body); an unhandled exception counts as a 500 of its type.
+    kpi_cache.clear()
+    try:
+        status, content = request(app, "POST", path, body, content_type=content_type)
+    except Exception as e:
+        return 500, type(e).__name__
+    return status, json.loads(content)
+
+
+def assert_parity(body: bytes, content_type="application/json"):
+    for explain in ("true", "false"):
+        expected = response(f"/analyze?explain={explain}", body, content_type)
+        assert response(f"/analyze/fast?explain={explain}", body, content_type) == expected, (body, explain)
+
+
+@pytest.mark.parametrize("body", MALFORMED)
+def test_malformed_body(body):
+    assert_parity(body)
+
+
+@pytest.mark.parametrize("content_type", CONTENT_TYPES)
+def test_content_type(content_type):
+    assert_parity(b'{"equity": 2, "cogs": "3"}', content_type)
+
+
+def test_random_bodies():
+    rng = random.Random(0)
+    for _ in range(1000):
+        payload = {name: random_field_value(rng) for name in FIELDS if rng.random() < 0.5}
+        if rng.random() < 0.2:
+            payload["unknown_field"] = random_field_value(rng)
+        assert_parity(json.dumps(payload).encode())
@@ -0,0 +1,85 @@
+import json
+
+import numpy as np
+import pytest
+
+from conftest import request
+import fin_analyst_api
+from fin_analyst_api import FIELDS, KPI_NAMES, app, calculate_kpi_matrix
+from kpi_peers import PeerStore
+
+
+def test_rank_against_populated_group():
+    statements = np.random.default_rng(0).uniform(0, 1e6, (50, len(FIELDS)))
+    body = json.dumps({"columns": dict(zip(FIELDS, statements.T.tolist()))}).encode()
+    status, response = request(app, "POST", "/peers/test-rank", body)
+    assert status == 200, response
+    try:
+        status, response = request(app, "POST", "/peers/test-rank/rank", json.dumps(dict(zip(FIELDS, statements[0].tolist()))).encode())
+        assert status == 200, response
+        result = json.loads(response)
+        assert set(result["percentiles"]) == set(KPI_NAMES)
+        assert all(0 <= value <= 100 for value in result["percentiles"].values())
+        # Ties count as half below: the group's own member with a unique value is at (2i + 1) / 2n.
+        row = np.sort(calculate_kpi_matrix(statements)[:, KPI_NAMES.index("EBITDA")])
+        rank = int(np.searchsorted(row, result["kpis"]["EBITDA"]))
+        assert result["percentiles"]["EBITDA"] == round((2 * rank + 1) / 2 / 50 * 100, 2)
+    finally:
+        fin_analyst_api.peer_store.remove("test-rank")
+
+
+@pytest.fixture(params=["memory", "directory"])
+def store(request, tmp_path):
+    return PeerStore(["a", "b"], str(tmp_path) if request.param == "directory" else None)
+
+
+def test_rank_counts_ties_as_half_below(store):
+    rng = np.random.default_rng(1)
+    first, second = rng.integers(0, 10, (30, 2)).astype(float), rng.integers(0, 10, (20, 2)).astype(float)
+    assert store.add("g", first) == 30
+    assert store.add("g", second) == 20
+    values = np.vstack([first, second])
+    for a, b in [(0.0, 9.0), (4.0, 4.5), (-1.0, 10.0)]:
+        result = store.rank("g", {"a": a, "b": b})
+        for name, value, column in [("a", a, values[:, 0]), ("b", b, values[:, 1])]:
+            expected = ((column < value).sum() + (column <= value).sum()) / 2 / len(column) * 100
+            assert result[name] == round(expected, 2)
+            assert type(result[name]) is float
+    assert store.rank("g", {"a": float("nan"), "b": 1.0})["a"] is None
+    assert store.rank("empty", {"a": 1.0, "b": 1.0}) == {"a": None, "b": None}
+
+
+def test_summary_matches_numpy(store):
+    values = np.random.default_rng(2).normal(size=(101, 2))
+    store.add("g", values[:50])
+    store.summary("g")
+    store.add("g", values[50:])
+    summary = store.summary("g")
+    assert summary["count"] == 101
+    for i, name in enumerate(["a", "b"]):
+        stats = summary["kpis"][name]
+        assert stats["mean"] == pytest.approx(values[:, i].mean())
+        assert (stats["min"], stats["max"]) == (values[:, i].min(), values[:, i].max())
+        for label, q in [("p10", 0.1), ("p25", 0.25), ("median", 0.5), ("p75", 0.75), ("p90", 0.9)]:
+            assert stats[label] == pytest.approx(np.quantile(values[:, i], q))
+
+
+def test_skips_non_finite_and_removes(store):
+    assert store.add("g", [[1.0, 2.0], [np.nan, 1.0], [3.0, np.inf]]) == 1
+    assert store.groups() == {"g": 1}
+    store.remove("g")
+    assert store.groups() == {}
+    assert store.summary("g") == {"count": 0, "kpis": {}}
+    with pytest.raises(ValueError):
+        store.add("../g", [[1.0, 2.0]])
+
+
+def test_directory_is_shared(tmp_path):
+    writer, reader = PeerStore(["a", "b"], str(tmp_path)), PeerStore(["a", "b"], str(tmp_path))
+    writer.add("g", [[1.0, 2.0]])
+    assert reader.summary("g")["count"] == 1
+    writer.add("g", [[3.0, 4.0]])
+    assert reader.summary("g")["count"] == 2
+    assert reader.rank("g", {"a": 2.0, "b": 5.0}) == {"a": 50.0, "b": 100.0}
+    with pytest.raises(ValueError):
+        PeerStore(["a"], str(tmp_path)).rank("g", {"a": 1.0})
@@ -0,0 +1,139 @@
+import asyncio
+import json
+import threading
+
+from fastapi import FastAPI, Request
+
+from conftest import request_async
+from kpi_scheduler import Scheduler
+
+
+def scheduled_app(scheduler: Scheduler, release: threading.Event, calls: list) -> FastAPI:
+    app = FastAPI()
+
+    def work(body: bytes) -> dict:
+        calls.append(body)
+        release.wait(5)
+        return {"body": body.decode()}
+
+    @app.post("/work")
+    async def post_work(request: Request):
+        return await scheduler.run(request, work, await request.body())
+
+    return app
+
+
+async def settle():
+    # Lets started requests reach the scheduler.
+    for _ in range(5):
+        await asyncio.sleep(0.01)
+
+
+def test_rejects_over_client_limit_and_full_queue():
+    scheduler = Scheduler(workers=1, max_queue=1, client_limit=1, coalesce=False)
+    release, calls = threading.Event(), []
+    app = scheduled_app(scheduler, release, calls)
+
+    async def main():
+        running = asyncio.ensure_future(request_async(app, "POST", "/work", b"1", client="10.0.0.1"))
+        await settle()
+        # The first client already has its one request in flight.
+        status, body = await request_async(app, "POST", "/work", b"2", client="10.0.0.1")
+        assert status == 429, body
+        queued = asyncio.ensure_future(request_async(app, "POST", "/work", b"3", client="10.0.0.2"))
+        await settle()
+        # One request runs, one waits: the queue is full.
+        status, body = await request_async(app, "POST", "/work", b"4", client="10.0.0.3")
+        assert status == 503, body
+        release.set()
+        return await running, await queued
+
+    try:
+        first, second = asyncio.run(main())
+    finally:
+        release.set()
+        scheduler.shutdown()
+    assert first == (200, b'{"body":"1"}')
+    assert second == (200, b'{"body":"3"}')
+    assert calls == [b"1", b"3"]
+    assert (scheduler.rejected_client, scheduler.rejected_queue, scheduler.completed) == (1, 1, 2)
+
+
+def test_coalesces_identical_requests():
+    scheduler = Scheduler(workers=2, max_queue=4, client_limit=4)
+    release, calls = threading.Event(), []
+    app = scheduled_app(scheduler, release, calls)
+
+    async def main():
+        requests = [asyncio.ensure_future(request_async(app, "POST", "/work", body, client=f"10.0.0.{i}"))
+                    for i, body in enumerate([b"same", b"same", b"other"])]
+        await settle()
+        release.set()
+        return await asyncio.gather(*requests)
+
+    try:
+        responses = asyncio.run(main())
+    finally:
+        release.set()
+        scheduler.shutdown()
+    assert [json.loads(body)["body"] for status, body in responses] == ["same", "same", "other"]
+    assert sorted(calls) == [b"other", b"same"]
+    assert scheduler.coalesced == 1
+
+
+def test_writes_do_not_coalesce():
+    scheduler = Scheduler(workers=2, max_queue=4, client_limit=4)
+    calls = []
+    app = FastAPI()
+
+    @app.post("/write")
+    async def write(request: Request):
+        return await scheduler.run(request, calls.append, await request.body(), coalesce=False)
+
+    async def main():
+        return await asyncio.gather(*[request_async(app, "POST", "/write", b"same") for _ in range(2)])
+
+    try:
+        asyncio.run(main())
+    finally:
+        scheduler.shutdown()
+    assert calls == [b"same", b"same"]
+    assert scheduler.coalesced == 0
+
+
+def test_admitted_request_holds_its_slot():
+    scheduler = Scheduler(workers=1, max_queue=1, client_limit=1)
+    app = FastAPI()
+    releases = []
+
+    @app.post("/admit")
+    async def admit(request: Request):
+        releases.append(scheduler.admit(request))
+        return await scheduler.run_admitted(sum, [1, 2])
+
+    async def main():
+        assert await request_async(app, "POST", "/admit") == (200, b"3")
+        # Not released yet: the client is at its limit.
+        assert (await request_async(app, "POST", "/admit"))[0] == 429
+        releases[0]()
+        releases[0]()
+        assert (await request_async(app, "POST", "/admit"))[0] == 200
+
+    try:
+        asyncio.run(main())
+    finally:
+        scheduler.shutdown()
+    assert scheduler.rejected_client == 1
+
+
+def test_stream_is_admitted_once():
+    import fin_analyst_api
+
+    body = b"".join(json.dumps({"equity": i, "cogs": 1}).encode() + b"\n" for i in range(fin_analyst_api.STREAM_CHUNK_RECORDS + 5))
+    status, response = asyncio.run(request_async(fin_analyst_api.app, "POST", "/analyze/stream", body,
+                                                 content_type="application/x-ndjson", client="10.0.1.1"))
+    assert status == 200
+    rows = [json.loads(line) for line in response.splitlines()]
+    assert [row["line"] for row in rows] == list(range(1, len(rows) + 1))
+    assert all("kpis" in row for row in rows)
+    assert "10.0.1.1" not in fin_analyst_api.scheduler._clients
@@ -0,0 +1,109 @@
+import asyncio
+import json
+import os
+
+import numpy as np
+import pytest
+from fastapi import HTTPException
+
+from conftest import request
+from kpi_snapshots import LazySnapshotStore, SnapshotStore
+
+NAMES = ["a", "b", "c"]
+
+
+def test_append_get_scan(tmp_path):
+    store = SnapshotStore(str(tmp_path), NAMES)
+    assert store.get("acme", 2020) is None
+    assert store.append(["acme", "acme", "other"], [2020, 2021, 2020], np.arange(9.0).reshape(3, 3)) == 3
+    assert store.get("acme", 2021) == {"a": 3.0, "b": 4.0, "c": 5.0}
+    assert store.get("acme", 2022) is None
+    # A later row for the same company and year wins.
+    store.append(["acme"], [2020], [[9.0, 9.0, 9.0]])
+    assert store.get("acme", 2020) == {"a": 9.0, "b": 9.0, "c": 9.0}
+    assert store.get("other", 2020) == {"a": 6.0, "b": 7.0, "c": 8.0}
+    assert store.scan("acme") == {"year": [2020, 2021], "a": [9.0, 3.0], "b": [9.0, 4.0], "c": [9.0, 5.0]}
+    assert store.scan("acme", start_year=2021) == {"year": [2021], "a": [3.0], "b": [4.0], "c": [5.0]}
+    assert store.scan("acme", end_year=2019) == {"year": [], "a": [], "b": [], "c": []}
+    assert store.count() == 3
+
+
+def test_appends_are_seen_by_other_stores(tmp_path):
+    writer, reader = SnapshotStore(str(tmp_path), NAMES), SnapshotStore(str(tmp_path), NAMES)
+    assert reader.get("acme", 2020) is None
+    writer.append(["acme"], [2020], [[1.0, 2.0, 3.0]])
+    assert reader.get("acme", 2020) == {"a": 1.0, "b": 2.0, "c": 3.0}
+    writer.append(["acme"], [2020], [[4.0, 5.0, 6.0]])
+    assert reader.get("acme", 2020) == {"a": 4.0, "b": 5.0, "c": 6.0}
+    with pytest.raises(ValueError):
+        SnapshotStore(str(tmp_path), ["a", "b"])
+
+
+def test_many_appends_keep_few_segments(tmp_path):
+    # Every (company, year) is the latest of the rows written for it, whatever the merges.
+    store = SnapshotStore(str(tmp_path), NAMES)
+    rng = np.random.default_rng(0)
+    latest = {}
+    for _ in range(60):
+        size = int(rng.integers(1, 20))
+        companies = [f"c{i}" for i in rng.integers(0, 30, size)]
+        years = rng.integers(2000, 2010, size).tolist()
+        values = rng.normal(size=(size, len(NAMES)))
+        store.append(companies, years, values)
+        latest.update({(company, year): row.tolist() for company, year, row in zip(companies, years, values)})
+    segments = [name for name in os.listdir(tmp_path) if name.startswith("index-")]
+    assert len(segments) <= np.log2(len(latest)) + 1
+    assert store.count() == len(latest)
+    for (company, year), row in latest.items():
+        assert store.get(company, year) == dict(zip(NAMES, row))
+    years = sorted(year for company, year in latest if company == "c1")
+    assert store.scan("c1")["year"] == years
+
+
+def test_rejects_invalid_keys(tmp_path):
+    store = SnapshotStore(str(tmp_path), NAMES)
+    for company, year in [("", 2020), ("x" * 65, 2020), ("a\0b", 2020), ("acme", 10000), ("acme", -1)]:
+        with pytest.raises(ValueError):
+            store.append([company], [year], [[1.0, 2.0, 3.0]])
+    assert store.count() == 0
+
+
+def test_lazy_store(tmp_path):
+    lazy = LazySnapshotStore("app", lambda: NAMES, root=str(tmp_path))
+    assert not os.path.exists(lazy.directory)
+    with pytest.raises(HTTPException) as raised:
+        asyncio.run(lazy.get("acme", 2020))
+    assert raised.value.status_code == 404
+    lazy().append(["acme"], [2020], [[1.0, 2.0, 3.0]])
+    assert asyncio.run(lazy.get("acme", 2020)) == {"a": 1.0, "b": 2.0, "c": 3.0}
+    assert lazy().current()
+    # Another process's append: the lookup loads it.
+    SnapshotStore(lazy.directory, NAMES).append(["acme"], [2021], [[4.0, 5.0, 6.0]])
+    assert not lazy().current()
+    assert asyncio.run(lazy.scan("acme"))["year"] == [2020, 2021]
+    with pytest.raises(HTTPException) as raised:
+        asyncio.run(lazy.get("", 2020))
+    assert raised.value.status_code == 422
+
+
+def test_routes_of_both_apps():
+    import fin_analyst_api
+    import financial_analyst_api
+
+    status, body = request(fin_analyst_api.app, "POST", "/kpis/route-test/2020", json.dumps({"equity": 5, "sales_revenue": 10}).encode())
+    assert status == 200, body
+    stored = json.loads(body)["kpis"]
+    status, body = request(fin_analyst_api.app, "GET", "/kpis/route-test/2020")
+    assert (status, json.loads(body)) == (200, {"company": "route-test", "year": 2020, "kpis": stored})
+    assert request(fin_analyst_api.app, "GET", "/kpis/route-test/2021")[0] == 404
+    status, body = request(fin_analyst_api.app, "GET", "/kpis/route-test")
+    assert json.loads(body)["year"] == [2020]
+
+    figures = {"data": {"2020": {"equity": 5}, "2021": {"equity": 6}}}
+    status, body = request(financial_analyst_api.app, "POST", "/calculateKPIs?company=route-test", json.dumps(figures).encode())
+    assert status == 200, body
+    expected = json.loads(body)
+    status, body = request(financial_analyst_api.app, "GET", "/kpis/route-test/2021")
+    assert (status, json.loads(body)) == (200, expected["2021"])
+    status, body = request(financial_analyst_api.app, "GET", "/kpis/route-test")
+    assert json.loads(body) == expected
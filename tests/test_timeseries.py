@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+
+from financial_analyst_api import FinancialDetails, new_time_series_panel
+
+FIELDS = list(FinancialDetails.__annotations__)
+
+
+def history(rng: np.random.Generator, companies: list, years: list) -> pd.DataFrame:
+    index = pd.MultiIndex.from_arrays([companies, years], names=["company", "year"])
+    return pd.DataFrame(rng.uniform(1, 1e6, (len(index), len(FIELDS))), index=index, columns=FIELDS)
+
+
+def test_append_matches_recompute():
+    # Appends of new years, earlier years and replaced years give the same history and
+    # summary as computing the whole panel at once.
+    rng = np.random.default_rng(0)
+    batches = [
+        history(rng, ["a"] * 3 + ["b"] * 2, [2018, 2019, 2020, 2019, 2020]),
+        history(rng, ["a", "c"], [2021, 2020]),
+        history(rng, ["b", "a"], [2017, 2019]),
+        history(rng, ["c", "c", "b"], [2021, 2022, 2020]),
+    ]
+    panel = new_time_series_panel()
+    panel.load(batches[0])
+    for batch in batches[1:]:
+        panel.append(batch)
+
+    inputs = pd.concat(batches)
+    kpis, summary = new_time_series_panel().compute(inputs[~inputs.index.duplicated(keep="last")])
+    for company in ["a", "b", "c"]:
+        stored, stored_summary = panel.history(company)
+        pd.testing.assert_frame_equal(stored, kpis.loc[[company]], check_exact=False)
+        pd.testing.assert_frame_equal(stored_summary, summary.loc[[company]], check_exact=False)
+
+
+def test_append_returns_recomputed_rows():
+    rng = np.random.default_rng(1)
+    panel = new_time_series_panel()
+    panel.load(history(rng, ["a"] * 3, [2018, 2019, 2020]))
+    kpis, summary = panel.append(history(rng, ["a"], [2019]))
+    # The replaced year and the one following it, whose deltas change.
+    assert kpis.index.tolist() == [("a", 2019), ("a", 2020)]
+    assert summary.index.tolist() == ["a"]
+    assert summary.loc["a", "Years"] == 3